@@ -0,0 +1,129 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+from fastapi import HTTPException
+
+# Upper bound on concurrent ingest requests when the database is healthy
+MAX_INFLIGHT_INGESTS = int(os.environ.get("MAX_INFLIGHT_INGESTS", "8"))
+
+# Upsert latency per LATENCY_ROWS_UNIT rows considered healthy; above it the concurrency limit shrinks proportionally
+TARGET_WRITE_LATENCY_MS = float(os.environ.get("TARGET_WRITE_LATENCY_MS", "1000"))
+
+# Write latencies are normalised to this many rows, so a healthy full batch doesn't read as
+# a slow database. Smaller writes count as a full unit: their fixed round trip dominates.
+LATENCY_ROWS_UNIT = 1000
+
+# Batch size the agent uses today (SELECT TOP 2000) and the floor we'll ask for under load
+DEFAULT_BATCH_SIZE = 2000
+MIN_BATCH_SIZE = 200
+
+# Minimum wait hinted to agents between sync cycles, and the cap under heavy load
+DEFAULT_POLL_INTERVAL_SECONDS = 60
+MAX_POLL_INTERVAL_SECONDS = 900
+
+LATENCY_EWMA_ALPHA = 0.2
+# Old latency samples fade out so a quiet backend recovers even without new writes
+LATENCY_HALF_LIFE_SECONDS = 30.0
+
+
+class IngestAdmissionController:
+    """
+    Tracks in-flight ingest work and an EWMA of upstream write latency per
+    LATENCY_ROWS_UNIT rows.
+    The allowed concurrency is MAX_INFLIGHT_INGESTS scaled down by
+    TARGET_WRITE_LATENCY_MS / latency (never below 1); requests beyond it are rejected with 429.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self._latency_ms = 0.0
+        self._latency_updated_at = time.monotonic()
+        self.rejected = 0
+
+    def record_write_latency(self, latency_ms: float):
+        with self._lock:
+            current = self._decayed_latency()
+            self._latency_ms = latency_ms if current == 0 else (
+                LATENCY_EWMA_ALPHA * latency_ms + (1 - LATENCY_EWMA_ALPHA) * current
+            )
+            self._latency_updated_at = time.monotonic()
+
+    def _decayed_latency(self) -> float:
+        elapsed = time.monotonic() - self._latency_updated_at
+        return self._latency_ms * 0.5 ** (elapsed / LATENCY_HALF_LIFE_SECONDS)
+
+    def write_latency_ms(self) -> float:
+        with self._lock:
+            return self._decayed_latency()
+
+    def _concurrency_limit(self) -> int:
+        latency = self._decayed_latency()
+        if latency <= TARGET_WRITE_LATENCY_MS:
+            return MAX_INFLIGHT_INGESTS
+        return max(1, int(MAX_INFLIGHT_INGESTS * TARGET_WRITE_LATENCY_MS / latency))
+
+    def concurrency_limit(self) -> int:
+        with self._lock:
+            return self._concurrency_limit()
+
+    def load_factor(self) -> float:
+        """~0 when idle, 1 at the admission limit, >1 when the database is slower than the target."""
+        latency_load = self.write_latency_ms() / TARGET_WRITE_LATENCY_MS
+        return max(self.inflight / MAX_INFLIGHT_INGESTS, latency_load)
+
+    def recommended_batch_size(self) -> int:
+        load = self.load_factor()
+        if load <= 0.5:
+            return DEFAULT_BATCH_SIZE
+        # Shrink linearly from the default at 50% load to the floor at 150%
+        scale = max(0.0, 1.5 - load)
+        return max(MIN_BATCH_SIZE, int(DEFAULT_BATCH_SIZE * scale))
+
+    def recommended_poll_interval_seconds(self) -> int:
+        load = self.load_factor()
+        if load <= 0.5:
+            return DEFAULT_POLL_INTERVAL_SECONDS
+        return min(MAX_POLL_INTERVAL_SECONDS, int(DEFAULT_POLL_INTERVAL_SECONDS * (1 + 4 * load)))
+
+    def retry_after_seconds(self) -> int:
+        # Jitter spreads a fleet of agents that got rejected at the same moment
+        base = self.recommended_poll_interval_seconds()
+        return min(MAX_POLL_INTERVAL_SECONDS, int(base * random.uniform(1.0, 1.5)))
+
+    @contextmanager
+    def admit(self):
+        with self._lock:
+            admitted = self.inflight < self._concurrency_limit()
+            if admitted:
+                self.inflight += 1
+            else:
+                self.rejected += 1
+        if not admitted:
+            retry_after = self.retry_after_seconds()
+            print(f"[Admission] Rejecting ingest: inflight={self.inflight}, write_latency_ms={self.write_latency_ms():.0f}, retry_after={retry_after}s")
+            raise HTTPException(
+                status_code=429,
+                detail="Ingest is overloaded, retry later",
+                headers={"Retry-After": str(retry_after)},
+            )
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+    @contextmanager
+    def timed_write(self, rows: int):
+        """Times one upstream write of `rows` rows and feeds its normalised latency into the EWMA."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000
+            self.record_write_latency(latency_ms * LATENCY_ROWS_UNIT / max(rows, LATENCY_ROWS_UNIT))
+
+
+ingest_admission = IngestAdmissionController()
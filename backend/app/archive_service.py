@@ -0,0 +1,289 @@
+import os
+import typing
+from datetime import date, datetime, timezone
+from typing import TYPE_CHECKING, Optional
+from uuid import UUID
+from .models import DelproSessionsMilkYield, DelproVoluntarySessionsMilkYield
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from supabase import Client
+
+# Local cold tier for closed months of DELPRO session history.
+# Layout: {ARCHIVE_ROOT}/{table}/farm_id={farm_id}/month={YYYY-MM}/part-0.parquet
+ARCHIVE_ROOT = os.environ.get("ARCHIVE_ROOT", os.path.join(os.path.dirname(__file__), "../archive"))
+
+SESSIONS_TABLE = "DELPRO_sessions_milk_yield"
+VOLUNTARY_TABLE = "DELPRO_voluntary_sessions_milk_yield"
+
+ARCHIVED_TABLES = {
+    SESSIONS_TABLE: DelproSessionsMilkYield,
+    VOLUNTARY_TABLE: DelproVoluntarySessionsMilkYield,
+}
+
+PAGE_SIZE = 1000  # PostgREST default max rows per request
+IN_FILTER_CHUNK = 500  # OIDs per .in_() request when fetching voluntary rows
+
+# Rows per Parquet row group; small enough that OID/BeginTime statistics prune well
+ROW_GROUP_SIZE = 10_000
+COMPRESSION = "zstd"
+
+
+def _arrow_type(annotation):
+    import pyarrow as pa
+
+    # Optional[X] -> X
+    args = [a for a in typing.get_args(annotation) if a is not type(None)]
+    if args:
+        annotation = args[0]
+    if annotation is bool:
+        return pa.bool_()
+    if annotation is int:
+        return pa.int64()
+    if annotation is float:
+        return pa.float64()
+    if annotation is datetime:
+        return pa.timestamp("us", tz="UTC")
+    if annotation in (str, UUID):
+        return pa.string()
+    raise TypeError(f"Unsupported column type for archive: {annotation}")
+
+
+def archive_schema(table: str):
+    """Arrow schema derived from the DELPRO Pydantic model, so every month file has the same columns and types."""
+    import pyarrow as pa
+
+    model = ARCHIVED_TABLES[table]
+    return pa.schema([
+        pa.field(name, _arrow_type(field.annotation))
+        for name, field in model.model_fields.items()
+        if name != "farm_id"  # stored as a partition key
+    ])
+
+
+def _month_bounds(month: str) -> tuple[datetime, datetime]:
+    start = datetime.strptime(month, "%Y-%m").replace(tzinfo=timezone.utc)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def _partition_dir(table: str, farm_id: str, month: str) -> str:
+    return os.path.join(ARCHIVE_ROOT, table, f"farm_id={farm_id}", f"month={month}")
+
+
+def _fetch_month_sessions(db: "Client", farm_id: str, start: datetime, end: datetime) -> list[dict]:
+    rows = []
+    offset = 0
+    while True:
+        res = db.table(SESSIONS_TABLE)\
+            .select("*")\
+            .eq("farm_id", farm_id)\
+            .gte("BeginTime", start.isoformat())\
+            .lt("BeginTime", end.isoformat())\
+            .order("OID")\
+            .range(offset, offset + PAGE_SIZE - 1)\
+            .execute()
+        rows.extend(res.data)
+        if len(res.data) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+    return rows
+
+
+def _fetch_voluntary(db: "Client", farm_id: str, oids: list[int]) -> list[dict]:
+    # Voluntary rows carry no timestamp; they belong to the month of the session with the same OID
+    rows = []
+    for i in range(0, len(oids), IN_FILTER_CHUNK):
+        res = db.table(VOLUNTARY_TABLE)\
+            .select("*")\
+            .eq("farm_id", farm_id)\
+            .in_("OID", oids[i:i + IN_FILTER_CHUNK])\
+            .execute()
+        rows.extend(res.data)
+    return rows
+
+
+def _write_partition(table: str, farm_id: str, month: str, rows: list[dict]) -> Optional[str]:
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if not rows:
+        return None
+
+    schema = archive_schema(table)
+    df = pd.DataFrame(rows).reindex(columns=schema.names)
+    for field in schema:
+        if pa.types.is_timestamp(field.type):
+            df[field.name] = pd.to_datetime(df[field.name], utc=True, format="ISO8601")
+    df = df.sort_values("OID", kind="stable")
+
+    arrow_table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+    directory = _partition_dir(table, farm_id, month)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "part-0.parquet")
+    tmp_path = path + ".tmp"
+    pq.write_table(
+        arrow_table,
+        tmp_path,
+        compression=COMPRESSION,
+        row_group_size=ROW_GROUP_SIZE,
+        write_statistics=True,
+    )
+    # Replace atomically so readers never see a half-written month
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_month(db: "Client", farm_id: str, month: str) -> dict:
+    """
+    Exports one closed month (YYYY-MM) of sessions and their voluntary rows
+    for a farm to Parquet. Re-running a month overwrites its files.
+    Rows are not deleted from Postgres.
+    """
+    start, end = _month_bounds(month)
+    current_month_start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if end > current_month_start:
+        raise ValueError(f"Month {month} is not closed yet")
+
+    print(f"[Archive] Exporting {month} for farm {farm_id}...")
+    sessions = _fetch_month_sessions(db, farm_id, start, end)
+    voluntary = _fetch_voluntary(db, farm_id, [r["OID"] for r in sessions if r.get("OID") is not None])
+
+    result = {
+        "farm_id": farm_id,
+        "month": month,
+        SESSIONS_TABLE: len(sessions),
+        VOLUNTARY_TABLE: len(voluntary),
+        "files": [
+            path for path in (
+                _write_partition(SESSIONS_TABLE, farm_id, month, sessions),
+                _write_partition(VOLUNTARY_TABLE, farm_id, month, voluntary),
+            ) if path
+        ],
+    }
+    print(f"[Archive] Exported {len(sessions)} sessions and {len(voluntary)} voluntary rows for {month}.")
+    return result
+
+
+def archived_months(table: str, farm_id: str) -> list[str]:
+    directory = os.path.join(ARCHIVE_ROOT, table, f"farm_id={farm_id}")
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name.split("=", 1)[1] for name in os.listdir(directory) if name.startswith("month="))
+
+
+def scan_archive(
+    table: str,
+    farm_id: Optional[str] = None,
+    columns: Optional[list[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    oids: Optional[list[int]] = None,
+) -> "pd.DataFrame":
+    """
+    Reads archived rows as a DataFrame, loading only `columns`.
+
+    Partition pruning skips other farms and months outside [start, end);
+    for sessions the BeginTime bound and for both tables the `oids` filter
+    are pushed down to the row-group statistics.
+    """
+    import pyarrow.dataset as ds
+
+    root = os.path.join(ARCHIVE_ROOT, table)
+    if not os.path.isdir(root):
+        import pandas as pd
+        return pd.DataFrame(columns=columns or archive_schema(table).names)
+
+    dataset = ds.dataset(root, format="parquet", partitioning="hive")
+
+    expression = None
+
+    def _and(condition):
+        nonlocal expression
+        expression = condition if expression is None else expression & condition
+
+    if farm_id is not None:
+        _and(ds.field("farm_id") == str(farm_id))
+    if start is not None:
+        _and(ds.field("month") >= start.strftime("%Y-%m"))
+        if table == SESSIONS_TABLE:
+            _and(ds.field("BeginTime") >= _as_utc(start))
+    if end is not None:
+        _and(ds.field("month") <= end.strftime("%Y-%m"))
+        if table == SESSIONS_TABLE:
+            _and(ds.field("BeginTime") < _as_utc(end))
+    if oids is not None:
+        _and(ds.field("OID").isin(list(oids)))
+
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def _as_utc(value: datetime):
+    import pyarrow as pa
+
+    if isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return pa.scalar(value, type=pa.timestamp("us", tz="UTC"))
+
+
+def read_session_history(
+    farm_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    session_columns: Optional[list[str]] = None,
+    voluntary_columns: Optional[list[str]] = None,
+) -> "pd.DataFrame":
+    """
+    Archived sessions joined with their voluntary rows on OID, the same join
+    process_mdi_predictions builds from the hot tables. Read by
+    predictor_service.backfill_predictions.
+    """
+    import pandas as pd
+
+    if session_columns is not None and "OID" not in session_columns:
+        session_columns = ["OID"] + session_columns
+    if voluntary_columns is not None and "OID" not in voluntary_columns:
+        voluntary_columns = ["OID"] + voluntary_columns
+
+    df_s = scan_archive(SESSIONS_TABLE, farm_id, session_columns, start, end)
+    if df_s.empty:
+        return df_s
+
+    # Restrict the voluntary scan to the same months and the OIDs we found
+    df_v = scan_archive(VOLUNTARY_TABLE, farm_id, voluntary_columns, start, end, oids=df_s["OID"].tolist())
+    return pd.merge(df_s, df_v, on="OID", how="inner")
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description="Export closed months of DELPRO session history to Parquet.")
+    parser.add_argument("--farm-id", required=True)
+    parser.add_argument("--month", action="append", required=True, help="Month to export as YYYY-MM (repeatable)")
+    parser.add_argument("--backfill-predictions", action="store_true",
+                        help="Then predict the exported sessions that have no mdi_predictor_mastertable row yet")
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
+    if not url or not key:
+        print("Error: SUPABASE_URL or SUPABASE_KEY not found in environment.")
+        exit(1)
+
+    db = create_client(url, key)
+    for month in args.month:
+        print(archive_month(db, args.farm_id, month))
+
+    if args.backfill_predictions:
+        import joblib
+        from .predictor_service import backfill_predictions
+
+        model = joblib.load(os.path.join(os.path.dirname(__file__), "ml_models/mdi_predictor_2d.joblib"))
+        print(backfill_predictions(db, args.farm_id, model, args.month))
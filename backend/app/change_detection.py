@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Total number of (farm, table, OID) fingerprints kept in memory, least recently seen evicted first
+FINGERPRINT_CACHE_MAX_ROWS = int(os.environ.get("FINGERPRINT_CACHE_MAX_ROWS", "500000"))
+
+# DelPro bumps these on every update, so they identify a row version without hashing it
+VERSION_FIELDS = ("OptimisticLockField", "Modified")
+
+
+def row_fingerprint(record: dict) -> str:
+    """
+    Version fingerprint of an ingested row: OptimisticLockField/Modified when
+    the row has them, otherwise a hash of the whole row content.
+    """
+    version = [record.get(field) for field in VERSION_FIELDS if field in record]
+    if any(v is not None for v in version):
+        return "v:" + "|".join(str(v) for v in version)
+    payload = json.dumps(record, sort_keys=True, default=str, separators=(",", ":"))
+    return "h:" + hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+class RowFingerprintCache:
+    """
+    Remembers the last written fingerprint per farm, table and OID so
+    ingest can drop rows the agent re-sends without changes.
+    """
+
+    def __init__(self, max_rows: int = FINGERPRINT_CACHE_MAX_ROWS):
+        self.max_rows = max_rows
+        self._rows: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter_changed(self, farm_id: str, table: str, records: list[dict]) -> tuple[list[dict], list[tuple]]:
+        """
+        Returns the records that are new or changed, plus the (key, fingerprint)
+        pairs to pass to remember() once they are written.
+        Rows without an OID are always treated as changed.
+        """
+        changed = []
+        pending = []
+        with self._lock:
+            for record in records:
+                oid: Optional[int] = record.get("OID")
+                fingerprint = row_fingerprint(record)
+                if oid is None:
+                    changed.append(record)
+                    continue
+                key = (farm_id, table, oid)
+                if self._rows.get(key) == fingerprint:
+                    self._rows.move_to_end(key)
+                    continue
+                changed.append(record)
+                pending.append((key, fingerprint))
+        return changed, pending
+
+    def remember(self, pending: list[tuple]):
+        """Stores fingerprints after a successful write."""
+        with self._lock:
+            for key, fingerprint in pending:
+                self._rows[key] = fingerprint
+                self._rows.move_to_end(key)
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+
+
+row_fingerprints = RowFingerprintCache()
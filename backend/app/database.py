@@ -1,22 +1,39 @@
 import os
+import threading
+from typing import TYPE_CHECKING, Any
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from .query_profiler import ProfiledClient
+
+if TYPE_CHECKING:
+    from supabase import Client
+else:
+    # The supabase package is slow to import; it is loaded on first client
+    # creation so it stays out of the app's cold start path.
+    Client = Any
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
 
 url: str = os.environ.get("SUPABASE_URL", "")
 key: str = os.environ.get("SUPABASE_KEY", "")
 
-supabase: Client = create_client(url, key)
+_supabase = None
+_supabase_lock = threading.Lock()
 
 def get_supabase_client() -> Client:
-    return supabase
+    global _supabase
+    if _supabase is None:
+        with _supabase_lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = ProfiledClient(create_client(url, key))
+    return _supabase
 
 def get_authenticated_supabase_client(token: str) -> Client:
     """
     Creates a Supabase client authenticated with the user's JWT token.
     This ensures that RLS policies are applied based on the user's identity.
     """
+    from supabase import create_client
     client = create_client(url, key)
     client.postgrest.auth(token)
-    return client
+    return ProfiledClient(client)
@@ -0,0 +1,21 @@
+import os
+import hmac
+from typing import Optional
+from fastapi import Header, HTTPException
+
+
+def is_debug_request_allowed(token: Optional[str]) -> bool:
+    """True when DEBUG_API_TOKEN is configured and `token` matches it."""
+    expected = os.environ.get("DEBUG_API_TOKEN", "")
+    return bool(expected) and token is not None and hmac.compare_digest(token, expected)
+
+
+def require_debug_token(x_debug_token: Optional[str] = Header(None)):
+    """
+    Dependency guarding the /api/debug endpoints.
+    They are disabled (404) unless DEBUG_API_TOKEN is set, and require a matching X-Debug-Token header.
+    """
+    if not os.environ.get("DEBUG_API_TOKEN"):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_debug_request_allowed(x_debug_token):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
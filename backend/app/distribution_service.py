@@ -0,0 +1,339 @@
+import math
+import os
+from datetime import date, datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from .database import Client, get_supabase_client, get_authenticated_supabase_client
+from .sampling_profiler import ProfiledRoute
+
+router = APIRouter(prefix="/api/v1/distribution", tags=["Distribution"], route_class=ProfiledRoute)
+
+security = HTTPBearer()
+
+# Width (kg) of the histogram bins used by the yield sketches.
+# Quantiles read from a sketch are exact up to half a bin.
+SKETCH_BIN_WIDTH = 0.5
+
+SKETCH_TABLE = "milk_yield_daily_sketches"
+PROVINCE_SKETCH_TABLE = "milk_yield_province_sketches"
+# See backend/sql/milk_yield_sketches.sql
+REFRESH_SKETCHES_RPC = "refresh_milk_yield_sketches"
+BACKFILL_SKETCHES_RPC = "backfill_milk_yield_sketches"
+
+# Sketches are kept per LactationNumber up to this value; higher parities share the last class
+MAX_PARITY = 8
+UNKNOWN_PARITY = 0
+
+DEFAULT_SPECIES = "C4"  # same default as the frontend
+
+PAGE_SIZE = 1000  # PostgREST default max rows per request
+BACKFILL_WINDOW_DAYS = 31
+
+
+class YieldSketch:
+    """
+    Mergeable summary of TotalYield values: a fixed-width histogram plus
+    count, sum, min and max. Merging two sketches is bin-wise addition, so
+    per farm/day sketches can be combined for any province and time window.
+    """
+
+    def __init__(self, bins: Optional[dict] = None, count: int = 0, total: float = 0.0,
+                 min_value: Optional[float] = None, max_value: Optional[float] = None):
+        self.bins = bins or {}
+        self.count = count
+        self.total = total
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def add(self, value: float):
+        if value is None or math.isnan(value) or math.isinf(value):
+            return
+        bin_index = int(math.floor(value / SKETCH_BIN_WIDTH))
+        self.bins[bin_index] = self.bins.get(bin_index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min_value = value if self.min_value is None else min(self.min_value, value)
+        self.max_value = value if self.max_value is None else max(self.max_value, value)
+
+    def merge(self, other: "YieldSketch"):
+        for bin_index, frequency in other.bins.items():
+            self.bins[bin_index] = self.bins.get(bin_index, 0) + frequency
+        self.count += other.count
+        self.total += other.total
+        if other.min_value is not None:
+            self.min_value = other.min_value if self.min_value is None else min(self.min_value, other.min_value)
+        if other.max_value is not None:
+            self.max_value = other.max_value if self.max_value is None else max(self.max_value, other.max_value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Linear interpolation inside the bin holding the q-th value."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bin_index in sorted(self.bins):
+            frequency = self.bins[bin_index]
+            if cumulative + frequency >= target:
+                fraction = (target - cumulative) / frequency if frequency else 0.0
+                value = (bin_index + fraction) * SKETCH_BIN_WIDTH
+                return min(max(value, self.min_value), self.max_value)
+            cumulative += frequency
+        return self.max_value
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def histogram(self, bin_width: float = SKETCH_BIN_WIDTH) -> list[dict]:
+        """Re-bins the sketch into the { bin_floor, frequency } rows used by the charts."""
+        step = max(1, int(round(bin_width / SKETCH_BIN_WIDTH)))
+        merged = {}
+        for bin_index, frequency in self.bins.items():
+            floor_index = (bin_index // step) * step
+            merged[floor_index] = merged.get(floor_index, 0) + frequency
+        return [
+            {"bin_floor": round(floor_index * SKETCH_BIN_WIDTH, 3), "frequency": merged[floor_index]}
+            for floor_index in sorted(merged)
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "bins": {str(k): v for k, v in self.bins.items()},
+            "count": self.count,
+            "total": self.total,
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "YieldSketch":
+        return cls(
+            bins={int(k): int(v) for k, v in (data.get("bins") or {}).items()},
+            count=int(data.get("count") or 0),
+            total=float(data.get("total") or 0.0),
+            min_value=data.get("min_value"),
+            max_value=data.get("max_value"),
+        )
+
+
+def _session_day(begin_time) -> Optional[str]:
+    if begin_time is None:
+        return None
+    if isinstance(begin_time, datetime):
+        return begin_time.date().isoformat()
+    # ISO strings as sent by the agent and validated at ingest
+    return str(begin_time)[:10]
+
+
+def parity_class(lactation_number) -> int:
+    if not lactation_number or lactation_number < 1:
+        return UNKNOWN_PARITY
+    return min(int(lactation_number), MAX_PARITY)
+
+
+def update_yield_sketches(db: Client, farm_id: str, session_records: list[dict]):
+    """
+    Refreshes the farm's sketches for the days touched by freshly ingested
+    sessions, and the province/species rollup of those days.
+
+    The database recomputes each touched (farm, day, parity) sketch from the
+    stored sessions (refresh_milk_yield_sketches), so a session written twice,
+    by a restarted or another instance, or with changed content, is counted once.
+    """
+    try:
+        days = sorted({day for day in (_session_day(r.get("BeginTime")) for r in session_records) if day})
+        if not days:
+            return
+        db.rpc(REFRESH_SKETCHES_RPC, {"p_farm_id": farm_id, "p_days": days}).execute()
+    except Exception as e:
+        print(f"[Distribution] Failed to refresh yield sketches for farm {farm_id}: {e}")
+
+
+def _first_session_day(db: Client, farm_id: str) -> Optional[date]:
+    res = db.table("DELPRO_sessions_milk_yield")\
+        .select("BeginTime")\
+        .eq("farm_id", farm_id)\
+        .not_.is_("BeginTime", "null")\
+        .order("BeginTime")\
+        .limit(1)\
+        .execute()
+    return date.fromisoformat(_session_day(res.data[0]["BeginTime"])) if res.data else None
+
+
+def backfill_yield_sketches(db: Client, farm_id: str, start_day: Optional[date] = None,
+                            end_day: Optional[date] = None) -> int:
+    """
+    Builds the sketches of a farm's existing session history, one
+    BACKFILL_WINDOW_DAYS window per call so each statement stays short.
+    Safe to re-run: every day is recomputed from the stored sessions.
+    Returns the number of days refreshed.
+    """
+    start_day = start_day or _first_session_day(db, farm_id)
+    end_day = end_day or date.today()
+    if start_day is None:
+        return 0
+
+    refreshed = 0
+    window_start = start_day
+    while window_start <= end_day:
+        window_end = min(end_day, window_start + timedelta(days=BACKFILL_WINDOW_DAYS - 1))
+        res = db.rpc(BACKFILL_SKETCHES_RPC, {
+            "p_farm_id": farm_id,
+            "p_from": window_start.isoformat(),
+            "p_to": window_end.isoformat(),
+        }).execute()
+        refreshed += int(res.data or 0)
+        window_start = window_end + timedelta(days=1)
+    return refreshed
+
+
+def merge_province_sketches(db: Client, province: str, species: str, min_parity: int, max_parity: Optional[int],
+                            start_day: date, end_day: date) -> tuple[YieldSketch, Optional[str], Optional[str]]:
+    """
+    Combines the province/species rollup rows for the window and parity range.
+    Returns the merged sketch and the first/last day that had data.
+
+    Reads go in day windows small enough for one response to stay under the
+    PostgREST row cap, so the cost is O(days) whatever the number of farms.
+    """
+    merged = YieldSketch()
+    days = []
+    low = parity_class(min_parity) if min_parity else UNKNOWN_PARITY
+    high = parity_class(max_parity) if max_parity else MAX_PARITY
+    days_per_page = max(1, PAGE_SIZE // (MAX_PARITY + 1))
+
+    window_start = start_day
+    while window_start <= end_day:
+        window_end = min(end_day, window_start + timedelta(days=days_per_page - 1))
+        res = db.table(PROVINCE_SKETCH_TABLE)\
+            .select("day, sketch")\
+            .eq("province", province)\
+            .eq("species", species)\
+            .gte("parity", low)\
+            .lte("parity", high)\
+            .gte("day", window_start.isoformat())\
+            .lte("day", window_end.isoformat())\
+            .execute()
+        for row in res.data:
+            sketch = YieldSketch.from_dict(row["sketch"])
+            if sketch.count:
+                merged.merge(sketch)
+                days.append(row["day"])
+        window_start = window_end + timedelta(days=1)
+
+    return merged, (min(days) if days else None), (max(days) if days else None)
+
+
+def _caller_profile(token: str) -> dict:
+    """Validates the bearer token and reads the caller's own profile through RLS."""
+    try:
+        user_db = get_authenticated_supabase_client(token)
+        user = user_db.auth.get_user(token).user
+    except Exception as e:
+        print(f"[Distribution] Rejected token: {e}")
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    res = user_db.table("profiles")\
+        .select("province, animal_species")\
+        .eq("id", user.id)\
+        .limit(1)\
+        .execute()
+    if not res.data or not res.data[0].get("province"):
+        raise HTTPException(status_code=400, detail="Profile has no province configured")
+    return res.data[0]
+
+
+@router.get("/milk-yield")
+def get_milk_yield_distribution(
+    start_date: date,
+    end_date: date,
+    min_parity: int = Query(1, ge=0),
+    max_parity: Optional[int] = Query(None, ge=1),
+    species: Optional[str] = None,
+    bin_width: float = 1.0,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Client = Depends(get_supabase_client),
+):
+    """
+    Regional TotalYield distribution built from pre-aggregated sketches.
+    Takes the filters of the get_milk_distribution and
+    get_milk_distribution_metadata RPCs (parity range, species) and returns
+    the same shapes. Province, and species unless given, come from the
+    caller's profile, as in the frontend.
+
+    The sketches span farms the user cannot see through RLS, so they are
+    read with the service client; only aggregates are returned.
+    """
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if max_parity is not None and max_parity < min_parity:
+        raise HTTPException(status_code=400, detail="max_parity must not be below min_parity")
+    if bin_width < SKETCH_BIN_WIDTH:
+        raise HTTPException(status_code=400, detail=f"bin_width must be at least {SKETCH_BIN_WIDTH}")
+
+    profile = _caller_profile(credentials.credentials)
+    province = profile["province"]
+    species = species or profile.get("animal_species") or DEFAULT_SPECIES
+
+    try:
+        sketch, min_day, max_day = merge_province_sketches(
+            db, province, species, min_parity, max_parity, start_date, end_date
+        )
+
+        return {
+            "distribution": sketch.histogram(bin_width),
+            "metadata": {
+                "province": province,
+                "species": species,
+                "min_date": min_day,
+                "max_date": max_day,
+                "sample_count": sketch.count,
+                "avg_val": sketch.mean(),
+                "p10_val": sketch.quantile(0.10),
+                "p25_val": sketch.quantile(0.25),
+                "p50_val": sketch.quantile(0.50),
+                "p75_val": sketch.quantile(0.75),
+                "p90_val": sketch.quantile(0.90),
+            },
+        }
+    except Exception as e:
+        print(f"[Distribution] Error building distribution for province {province}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description="Build the milk yield sketches of existing session history.")
+    parser.add_argument("--farm-id", action="append", help="Farm to backfill (repeatable); all farms if omitted")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day (YYYY-MM-DD); defaults to the farm's first session")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day (YYYY-MM-DD); defaults to today")
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
+    if not url or not key:
+        print("Error: SUPABASE_URL or SUPABASE_KEY not found in environment.")
+        exit(1)
+
+    db = create_client(url, key)
+    farm_ids = args.farm_id or []
+    if not farm_ids:
+        last_id = None
+        while True:
+            query = db.table("farms").select("id")
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            res = query.order("id").limit(PAGE_SIZE).execute()
+            farm_ids.extend(row["id"] for row in res.data)
+            if len(res.data) < PAGE_SIZE:
+                break
+            last_id = res.data[-1]["id"]
+    for farm_id in farm_ids:
+        days = backfill_yield_sketches(db, farm_id, args.start, args.end)
+        print(f"[Distribution] Backfilled {days} days of yield sketches for farm {farm_id}")
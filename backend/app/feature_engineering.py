@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+
+def grouped_rolling_means(df: pd.DataFrame, group_col: str, windows: dict[int, list[str]], suffix: str = "_ma") -> pd.DataFrame:
+    """
+    Adds per-group trailing rolling means for several columns in one pass.
+
+    Equivalent to
+        df.groupby(group_col)[col].transform(lambda x: x.rolling(window=w, min_periods=1).mean())
+    for every column `col` listed under window `w`, written to f"{col}{suffix}{w}".
+
+    Rows keep their order inside each group (as groupby does), missing values
+    are skipped and a window with no observations yields NaN. Rows whose group
+    key is missing get NaN, matching groupby's dropna behaviour.
+
+    The means come from cumulative sums of values and non-missing counts over
+    the group-contiguous arrays, so the cost is O(rows) per column with no
+    Python-level loop over groups.
+    """
+    n = len(df)
+    if n == 0:
+        for window, cols in windows.items():
+            for col in cols:
+                if col in df.columns:
+                    df[f"{col}{suffix}{window}"] = pd.Series(dtype=float)
+        return df
+
+    codes, _ = pd.factorize(df[group_col], sort=False)
+    valid_group = codes >= 0
+
+    # Stable sort makes each group contiguous while keeping its row order
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+
+    # Position of the first row of each row's group inside the sorted arrays
+    is_start = np.empty(n, dtype=bool)
+    is_start[0] = True
+    is_start[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    group_start = np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+
+    positions = np.arange(n)
+    for window, cols in windows.items():
+        # Window [lo, i] clipped to the group start; prefix sums are offset by one
+        lo = np.maximum(positions - window + 1, group_start)
+
+        for col in cols:
+            if col not in df.columns:
+                continue
+            values = df[col].to_numpy(dtype=float, na_value=np.nan)[order]
+            present = ~np.isnan(values)
+
+            # Centering on the column mean keeps the running sums small,
+            # which keeps the differences within float rounding of pandas
+            offset = values[present].mean() if present.any() else 0.0
+
+            csum = np.zeros(n + 1)
+            np.cumsum(np.where(present, values - offset, 0.0), out=csum[1:])
+            ccount = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(present, out=ccount[1:])
+
+            window_sum = csum[positions + 1] - csum[lo]
+            window_count = ccount[positions + 1] - ccount[lo]
+
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means_sorted = np.where(window_count > 0, offset + window_sum / window_count, np.nan)
+
+            means = np.empty(n)
+            means[order] = means_sorted
+            means[~valid_group] = np.nan
+            df[f"{col}{suffix}{window}"] = means
+
+    return df
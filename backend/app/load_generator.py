@@ -0,0 +1,590 @@
+"""
+Multi-agent load generator for end-to-end capacity testing of the backend.
+
+Simulates N DelPro agents following the real sync protocol
+(GET /api/sync/status, then POST /api/v1/ingest) against the FastAPI app
+served by uvicorn in-process, with an in-memory stand-in for Supabase.
+Agents upload only rows above the returned watermarks and follow the backend's
+batch size, poll interval and Retry-After hints, with time compressed so that
+the default 60 s poll takes --poll-interval seconds.
+
+    python -m app.load_generator --agents 1,5,10,25 --stage-seconds 30 --poll-interval 2
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+import httpx
+import uvicorn
+
+from . import database
+from .main import app, ml_models
+from .query_profiler import ProfiledClient
+from .distribution_service import YieldSketch, parity_class
+from .admission_control import DEFAULT_POLL_INTERVAL_SECONDS
+
+
+# --- In-memory Supabase stand-in ---
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+def _comparable(value):
+    # Rows hold ISO strings (as sent to ingest); filters may pass datetimes
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class _InMemoryRpc:
+    def __init__(self, store: "InMemorySupabase", handler, params: dict):
+        self._store = store
+        self._handler = handler
+        self._params = params
+
+    def execute(self):
+        if self._store.latency_seconds:
+            time.sleep(self._store.latency_seconds)
+        return _Result(self._handler(**self._params))
+
+
+class _InMemoryQuery:
+    """Subset of the postgrest builder API used by the backend."""
+
+    def __init__(self, store: "InMemorySupabase", table: str):
+        self._store = store
+        self._table = table
+        self._operation = "select"
+        self._columns = None
+        self._rows = None
+        self._on_conflict = None
+        self._filters = []
+        self._order = None
+        self._limit = None
+        self._range = None
+
+    def select(self, columns: str = "*", **kwargs):
+        self._operation = "select"
+        if columns.strip() != "*":
+            self._columns = [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, rows, **kwargs):
+        self._operation, self._rows = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict: Optional[str] = None, **kwargs):
+        self._operation, self._rows = "upsert", rows if isinstance(rows, list) else [rows]
+        self._on_conflict = on_conflict
+        return self
+
+    def _filter(self, column, predicate):
+        self._filters.append((column, predicate))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, lambda v: v == _comparable(value))
+
+    def neq(self, column, value):
+        return self._filter(column, lambda v: v != _comparable(value))
+
+    def gt(self, column, value):
+        return self._filter(column, lambda v: v is not None and v > _comparable(value))
+
+    def gte(self, column, value):
+        return self._filter(column, lambda v: v is not None and v >= _comparable(value))
+
+    def lt(self, column, value):
+        return self._filter(column, lambda v: v is not None and v < _comparable(value))
+
+    def lte(self, column, value):
+        return self._filter(column, lambda v: v is not None and v <= _comparable(value))
+
+    def in_(self, column, values):
+        allowed = set(values)
+        return self._filter(column, lambda v: v in allowed)
+
+    def order(self, column, desc: bool = False, **kwargs):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count, **kwargs):
+        self._limit = count
+        return self
+
+    def range(self, start, end, **kwargs):
+        self._range = (start, end)
+        return self
+
+    def execute(self):
+        if self._store.latency_seconds:
+            time.sleep(self._store.latency_seconds)
+        if self._operation == "select":
+            return _Result(self._store.select(self))
+        return _Result(self._store.write(self._table, self._rows, self._operation, self._on_conflict))
+
+
+class InMemorySupabase:
+    """
+    Thread-safe dict-of-tables standing in for the Supabase client.
+    Upserts key on on_conflict columns when given, else on (farm_id, OID).
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_seconds = latency_ms / 1000
+        self._tables = defaultdict(dict)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> _InMemoryQuery:
+        return _InMemoryQuery(self, name)
+
+    def rpc(self, fn: str, params: Optional[dict] = None):
+        handler = getattr(self, f"_rpc_{fn}", None)
+        if handler is None:
+            raise NotImplementedError(f"rpc {fn} is not simulated")
+        return _InMemoryRpc(self, handler, params or {})
+
+    def _rpc_refresh_milk_yield_sketches(self, p_farm_id, p_days):
+        """Same recompute-from-sessions as the SQL function in backend/sql/milk_yield_sketches.sql."""
+        days = set(p_days)
+        with self._lock:
+            profile = next((r for r in self._tables["profiles"].values() if r.get("farm_id") == p_farm_id), {})
+            province, species = profile.get("province"), profile.get("animal_species") or "C4"
+            parities = {}
+            for row in self._tables["DELPRO_animals_lactations_summary"].values():
+                if row.get("farm_id") == p_farm_id and row.get("Animal") is not None:
+                    parities[row["Animal"]] = max(parities.get(row["Animal"]) or 0, row.get("LactationNumber") or 0)
+
+            farm_sketches = {}
+            for row in self._tables["DELPRO_sessions_milk_yield"].values():
+                day = str(row.get("BeginTime") or "")[:10]
+                if row.get("farm_id") != p_farm_id or day not in days or row.get("TotalYield") is None:
+                    continue
+                key = (day, parity_class(parities.get(row.get("BasicAnimal"))))
+                farm_sketches.setdefault(key, YieldSketch()).add(float(row["TotalYield"]))
+
+            daily = self._tables["milk_yield_daily_sketches"]
+            for key in [k for k, r in daily.items() if r["farm_id"] == p_farm_id and r["day"] in days]:
+                del daily[key]
+            for (day, parity), sketch in farm_sketches.items():
+                daily[(p_farm_id, day, parity)] = {
+                    "farm_id": p_farm_id, "day": day, "parity": parity,
+                    "province": province, "species": species, "sketch": sketch.to_dict(),
+                }
+
+            if province is not None:
+                rollup = {}
+                for row in daily.values():
+                    if row["province"] == province and row["species"] == species and row["day"] in days:
+                        rollup.setdefault((row["day"], row["parity"]), YieldSketch()).merge(YieldSketch.from_dict(row["sketch"]))
+                stored = self._tables["milk_yield_province_sketches"]
+                for key in [k for k, r in stored.items()
+                            if r["province"] == province and r["species"] == species and r["day"] in days]:
+                    del stored[key]
+                for (day, parity), sketch in rollup.items():
+                    stored[(province, species, day, parity)] = {
+                        "province": province, "species": species, "day": day, "parity": parity,
+                        "sketch": sketch.to_dict(),
+                    }
+        return None
+
+    def _rpc_get_latest_risk_per_animal(self, p_farm_id, p_since, p_after_animal=None, p_limit=1000):
+        """Same distinct-on-animal read as the SQL function in backend/sql/risk_cache.sql."""
+        with self._lock:
+            latest = {}
+            for row in self._tables["mdi_predictor_mastertable"].values():
+                if row.get("farm_id") != p_farm_id or (row.get("BeginTime") or "") < p_since:
+                    continue
+                if p_after_animal is not None and row["animal_oid"] <= p_after_animal:
+                    continue
+                current = latest.get(row["animal_oid"])
+                if current is None or (row.get("BeginTime") or "") >= (current.get("BeginTime") or ""):
+                    latest[row["animal_oid"]] = dict(row)
+        return [latest[oid] for oid in sorted(latest)][:p_limit]
+
+    def count(self, table: str, farm_id: Optional[str] = None) -> int:
+        with self._lock:
+            rows = self._tables[table].values()
+            return sum(1 for r in rows if farm_id is None or r.get("farm_id") == farm_id)
+
+    def _key(self, row: dict, on_conflict: Optional[str]):
+        if on_conflict:
+            return tuple(row.get(c.strip()) for c in on_conflict.split(","))
+        if row.get("OID") is not None:
+            return (row.get("farm_id"), row["OID"])
+        self._next_id += 1
+        return ("id", self._next_id)
+
+    def write(self, table: str, rows: list[dict], operation: str, on_conflict: Optional[str]) -> list[dict]:
+        with self._lock:
+            stored = self._tables[table]
+            for row in rows:
+                if operation == "insert":
+                    self._next_id += 1
+                    key = ("id", self._next_id)
+                else:
+                    key = self._key(row, on_conflict)
+                stored[key] = dict(row)
+            return [dict(r) for r in rows]
+
+    def select(self, query: _InMemoryQuery) -> list[dict]:
+        with self._lock:
+            rows = [r for r in self._tables[query._table].values()
+                    if all(predicate(r.get(column)) for column, predicate in query._filters)]
+        if query._order:
+            column, desc = query._order
+            present = [r for r in rows if r.get(column) is not None]
+            missing = [r for r in rows if r.get(column) is None]
+            rows = sorted(present, key=lambda r: r[column], reverse=desc) + missing
+        if query._range:
+            rows = rows[query._range[0]:query._range[1] + 1]
+        if query._limit is not None:
+            rows = rows[:query._limit]
+        if query._columns:
+            rows = [{c: r.get(c) for c in query._columns} for r in rows]
+        return [dict(r) for r in rows]
+
+
+class PersistenceModel:
+    """Stand-in predictor: forecasts that the current MDI persists."""
+
+    def predict(self, X):
+        return np.asarray(X["Mdi"], dtype=float)
+
+
+# --- Simulated agents ---
+
+# Mirrors local-agent/Program.cs: rows per table per upload, and the wait after a failed cycle
+AGENT_BATCH_SIZE = 2000
+ERROR_RETRY_SECONDS = 60
+
+class StageMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+        self.exceptions = 0
+        self.rows_sent = 0
+        self.rows_skipped = 0
+
+    def record(self, endpoint: str, latency: float, status_code: Optional[int]):
+        with self.lock:
+            self.latencies[endpoint].append(latency)
+            if status_code is None:
+                self.exceptions += 1
+            else:
+                self.status_codes[endpoint][status_code] += 1
+
+
+class SimulatedAgent:
+    """One farm's DelPro agent: a local DelPro database that keeps growing, and the sync loop.
+
+    Like FetchBatchData in local-agent/Program.cs, each cycle uploads only the rows above the
+    watermarks returned by /api/sync/status, at most recommended_batch_size per table.
+    """
+
+    def __init__(self, base_url: str, herd_size: int, sessions_per_cycle: int, rng: random.Random, time_scale: float):
+        self.farm_id = str(uuid.uuid4())
+        self.base_url = base_url
+        self.sessions_per_cycle = sessions_per_cycle
+        self.rng = rng
+        # Backend hints are in real seconds; the simulation runs time_scale simulated seconds per real one
+        self.time_scale = time_scale
+        # The agent's DelPro tables, keyed by OID
+        self.animals: dict[int, dict] = {}
+        self.lactations: dict[int, dict] = {}
+        self.sessions: dict[int, dict] = {}
+        self.voluntary: dict[int, dict] = {}
+        self.next_session_oid = 1
+        for _ in range(herd_size):
+            self._add_animal(with_lactation=True)
+        self.client = httpx.Client(base_url=base_url, timeout=120)
+
+    def _add_animal(self, with_lactation: bool):
+        oid = len(self.animals) + 1
+        self.animals[oid] = {
+            "OID": oid, "Number": oid, "Name": f"Cow {oid}", "Sex": 2, "Group": 1,
+            "OptimisticLockField": 1, "Modified": datetime.now().isoformat(),
+        }
+        if with_lactation:
+            start = (datetime.now() - timedelta(days=120)).isoformat()
+            self.lactations[oid] = {"OID": oid, "Animal": oid, "LactationNumber": 1 + oid % 4, "StartDate": start, "OptimisticLockField": 1}
+
+    def _milk(self, count: int):
+        """Adds a cycle's milkings to the local tables, whether or not they get synced."""
+        now = datetime.now()
+        cows = list(self.lactations)
+        for i in range(count):
+            oid = self.next_session_oid
+            self.next_session_oid += 1
+            begin = now - timedelta(minutes=(count - i) * 3)
+            total_yield = max(0.0, self.rng.gauss(12, 3))
+            self.sessions[oid] = {
+                "SessionNo": str(oid), "OID": oid, "BasicAnimal": self.rng.choice(cows),
+                "BeginTime": begin.isoformat(), "EndTime": (begin + timedelta(minutes=7)).isoformat(),
+                "TotalYield": round(total_yield, 2), "ExpectedYield": round(total_yield * self.rng.uniform(0.9, 1.1), 2),
+                "AvgConductivity": round(self.rng.gauss(5.0, 0.4), 2), "MaxConductivity": round(self.rng.gauss(5.8, 0.5), 2),
+                "MaxBlood": round(abs(self.rng.gauss(0.05, 0.05)), 3), "Destination": 1,
+            }
+            quarter = lambda mu, sd: round(self.rng.gauss(mu, sd), 2)
+            self.voluntary[oid] = {
+                "OID": oid, "Mdi": round(abs(self.rng.gauss(1.2, 0.5)), 2),
+                "MilkFlowDuration": self.rng.randint(240, 600), "SmartPulsationRatio": self.rng.randint(55, 70),
+                "CurrentCombinedAmd": round(self.rng.uniform(0, 3), 2),
+                "Incomplete": int(self.rng.random() < 0.05), "Kickoff": int(self.rng.random() < 0.03),
+                **{f"Conductivity{q}": quarter(5.0, 0.4) for q in ("LF", "RF", "LR", "RR")},
+                **{f"Blood{q}": abs(quarter(0.02, 0.03)) for q in ("LF", "RF", "LR", "RR")},
+                **{f"PeakFlow{q}": abs(quarter(1.1, 0.2)) for q in ("LF", "RF", "LR", "RR")},
+            }
+        # Now and then a calf is registered; it isn't milked until it has a lactation
+        if self.rng.random() < 0.1:
+            self._add_animal(with_lactation=False)
+
+    @staticmethod
+    def _above(table: dict[int, dict], watermark: int, batch_size: int) -> list[dict]:
+        # SELECT TOP (@BatchSize) * ... WHERE OID > @Watermark ORDER BY OID
+        oids = sorted(oid for oid in table if oid > watermark)[:batch_size]
+        return [table[oid] for oid in oids]
+
+    def _prune(self, last_oid: int):
+        # Sessions at or below the watermark are on the backend and won't be selected again
+        for oid in [oid for oid in self.sessions if oid <= last_oid]:
+            del self.sessions[oid]
+            del self.voluntary[oid]
+
+    def run_cycle(self, metrics: StageMetrics, poll_interval: float) -> float:
+        """Runs one sync cycle and returns how long to wait before the next, in real seconds."""
+        self._milk(self.sessions_per_cycle)
+
+        start = time.perf_counter()
+        try:
+            res = self.client.get("/api/sync/status", params={"farm_id": self.farm_id})
+            metrics.record("sync_status", time.perf_counter() - start, res.status_code)
+            if res.status_code != 200:
+                return ERROR_RETRY_SECONDS / self.time_scale
+            status = res.json()
+        except httpx.HTTPError:
+            metrics.record("sync_status", time.perf_counter() - start, None)
+            return ERROR_RETRY_SECONDS / self.time_scale
+
+        self._prune(status["last_oid"])
+        batch_size = min(max(1, status.get("recommended_batch_size", AGENT_BATCH_SIZE)), AGENT_BATCH_SIZE)
+        interval = max(poll_interval, status.get("recommended_poll_interval_seconds", 0) / self.time_scale)
+
+        sessions = self._above(self.sessions, status["last_oid"], batch_size)
+        payload = {
+            "farm_id": self.farm_id,
+            "basic_animals": self._above(self.animals, status["last_animal_oid"], batch_size),
+            "lactations_summary": self._above(self.lactations, status["last_lactation_oid"], batch_size),
+            "sessions_milk_yield": sessions,
+            "voluntary_sessions_milk_yield": [self.voluntary[s["OID"]] for s in sessions],
+            "history_milk_diversion_info": [],
+            "history_animals": [],
+        }
+        rows = sum(len(v) for v in payload.values() if isinstance(v, list))
+        if rows == 0:
+            return interval
+
+        start = time.perf_counter()
+        try:
+            res = self.client.post("/api/v1/ingest", content=json.dumps(payload), headers={"Content-Type": "application/json"})
+            metrics.record("ingest", time.perf_counter() - start, res.status_code)
+        except httpx.HTTPError:
+            metrics.record("ingest", time.perf_counter() - start, None)
+            return ERROR_RETRY_SECONDS / self.time_scale
+        if res.status_code == 200:
+            if sessions:
+                self._prune(sessions[-1]["OID"])
+            body = res.json()
+            with metrics.lock:
+                metrics.rows_sent += rows
+                metrics.rows_skipped += sum(body.get("skipped", {}).values())
+        elif res.status_code in (429, 503):
+            # Refused rows stay above the watermark and are selected again after Retry-After
+            retry_after = res.headers.get("Retry-After")
+            return (int(retry_after) if retry_after and retry_after.isdigit() else ERROR_RETRY_SECONDS) / self.time_scale
+        return interval
+
+    def backlog(self) -> int:
+        """Milkings recorded locally but not yet on the backend."""
+        return len(self.sessions)
+
+
+def _agent_loop(agent: SimulatedAgent, metrics: StageMetrics, poll_interval: float, stop: threading.Event):
+    # Random phase so agents don't all poll in lockstep
+    stop.wait(agent.rng.uniform(0, poll_interval))
+    while not stop.is_set():
+        stop.wait(agent.run_cycle(metrics, poll_interval))
+
+
+# --- Reporting ---
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    arr = np.asarray(values) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(arr, 50)), 1),
+        "p95_ms": round(float(np.percentile(arr, 95)), 1),
+        "p99_ms": round(float(np.percentile(arr, 99)), 1),
+        "max_ms": round(float(arr.max()), 1),
+    }
+
+
+def _stage_report(agents: list[SimulatedAgent], seconds: float, metrics: StageMetrics, store: InMemorySupabase) -> dict:
+    sessions = store.count("DELPRO_sessions_milk_yield")
+    predictions = store.count("mdi_predictor_mastertable")
+    report = {"agents": len(agents), "seconds": round(seconds, 1)}
+    for endpoint in ("sync_status", "ingest"):
+        latencies = metrics.latencies[endpoint]
+        codes = metrics.status_codes[endpoint]
+        total = len(latencies)
+        errors = sum(n for code, n in codes.items() if code >= 500)
+        report[endpoint] = {
+            "requests": total,
+            "throughput_rps": round(total / seconds, 2) if seconds else None,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "throttled": codes.get(429, 0),
+            "status_codes": dict(codes),
+            **_percentiles(latencies),
+        }
+    report["exceptions"] = metrics.exceptions
+    report["rows_per_second"] = round(metrics.rows_sent / seconds, 1) if seconds else None
+    report["rows_skipped"] = metrics.rows_skipped
+    report["prediction_backlog"] = max(0, sessions - predictions)
+    report["unsynced_sessions"] = sum(agent.backlog() for agent in agents)
+    return report
+
+
+def _print_report(report: dict, out):
+    ingest, status = report["ingest"], report["sync_status"]
+    print(
+        f"agents={report['agents']:>4}  "
+        f"ingest: {ingest['throughput_rps']:>6} rps p50={ingest['p50_ms']}ms p95={ingest['p95_ms']}ms p99={ingest['p99_ms']}ms "
+        f"err={ingest['error_rate']:.2%} 429={ingest['throttled']}  "
+        f"status: p95={status['p95_ms']}ms err={status['error_rate']:.2%}  "
+        f"rows/s={report['rows_per_second']} skipped={report['rows_skipped']} backlog={report['prediction_backlog']} unsynced={report['unsynced_sessions']}",
+        file=out, flush=True,
+    )
+
+
+# --- Runner ---
+
+def _start_server() -> tuple[uvicorn.Server, threading.Thread, str]:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def run_load_test(
+    agent_stages: list[int],
+    stage_seconds: float,
+    poll_interval: float,
+    herd_size: int,
+    sessions_per_cycle: int,
+    db_latency_ms: float,
+    with_predictions: bool,
+    seed: int,
+    out=sys.stdout,
+) -> list[dict]:
+    store = InMemorySupabase(latency_ms=db_latency_ms)
+    # The app resolves its client through database.get_supabase_client(); point it at the stand-in
+    database._supabase = ProfiledClient(store)
+
+    server, thread, base_url = _start_server()
+    if with_predictions:
+        ml_models["mastitis"] = PersistenceModel()
+
+    rng = random.Random(seed)
+    # Simulated seconds per real second, so the backend's poll and Retry-After hints keep their proportions
+    time_scale = DEFAULT_POLL_INTERVAL_SECONDS / poll_interval
+    agents: list[SimulatedAgent] = []
+    reports = []
+    try:
+        for target in agent_stages:
+            while len(agents) < target:
+                agent = SimulatedAgent(base_url, herd_size, sessions_per_cycle, random.Random(rng.random()), time_scale)
+                # Farm profile, read by the yield sketch rollup
+                store.write("profiles", [{"farm_id": agent.farm_id, "province": "Load Test", "animal_species": "C4"}], "insert", None)
+                agents.append(agent)
+
+            metrics = StageMetrics()
+            stop = threading.Event()
+            threads = [
+                threading.Thread(target=_agent_loop, args=(agent, metrics, poll_interval, stop), daemon=True)
+                for agent in agents
+            ]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            time.sleep(stage_seconds)
+            stop.set()
+            for t in threads:
+                t.join()
+
+            report = _stage_report(agents, time.perf_counter() - started, metrics, store)
+            reports.append(report)
+            _print_report(report, out)
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        for agent in agents:
+            agent.client.close()
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a fleet of DelPro agents against the backend.")
+    parser.add_argument("--agents", default="1,5,10,25", help="Comma separated fleet sizes, run as successive stages")
+    parser.add_argument("--stage-seconds", type=float, default=30)
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between agent sync cycles")
+    parser.add_argument("--herd-size", type=int, default=120)
+    parser.add_argument("--sessions-per-cycle", type=int, default=100)
+    parser.add_argument("--db-latency-ms", type=float, default=20.0, help="Simulated latency per Supabase call")
+    parser.add_argument("--no-predictions", action="store_true", help="Don't run the background MDI predictor")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Write the stage reports to this file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the backend's own console output")
+    args = parser.parse_args()
+
+    report_out = sys.stdout
+    if not args.verbose:
+        # The backend prints per request; keep the console for the report
+        sys.stdout = open(os.devnull, "w")
+
+    results = run_load_test(
+        agent_stages=[int(n) for n in args.agents.split(",")],
+        stage_seconds=args.stage_seconds,
+        poll_interval=args.poll_interval,
+        herd_size=args.herd_size,
+        sessions_per_cycle=args.sessions_per_cycle,
+        db_latency_ms=args.db_latency_ms,
+        with_predictions=not args.no_predictions,
+        seed=args.seed,
+        out=report_out,
+    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,17 +1,28 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-import os
-import joblib
-from pydantic import BaseModel
-from .models import IngestPayload, SyncStatusResponse, FarmRegistrationRequest, FarmRegistrationResponse
-from .database import get_supabase_client, get_authenticated_supabase_client
-from supabase import Client
-from .predictor_service import process_mdi_predictions
+from pydantic import BaseModel, ValidationError
+from .models import IngestPayload, INGEST_PAYLOAD_ADAPTER, INGEST_ROW_DEFAULTS, SyncStatusResponse, FarmRegistrationRequest, FarmRegistrationResponse
+from .database import Client, get_supabase_client, get_authenticated_supabase_client
 from .notification_service import router as notification_router
+from .distribution_service import router as distribution_router, update_yield_sketches
+from .timeseries_service import router as timeseries_router
+from .risk_cache import router as risk_router
+from .query_profiler import router as query_profiler_router, start_request_profile, header_summary
+from .sampling_profiler import router as sampling_profiler_router, sampling_profiler, ProfiledRoute
+from .debug_auth import is_debug_request_allowed
+from .admission_control import ingest_admission
+from .change_detection import row_fingerprints
+from .quarter_detector import detect_quarter_deviations
+from .warmup_service import warm_up, start_background_warmup, is_fast_start_enabled, is_warming_up, record_app_import_time, readiness_report, WARMUP_RETRY_AFTER_SECONDS
 
 load_dotenv()
 
@@ -20,20 +31,28 @@ ml_models = {}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Load the ML model
-    model_path = os.path.join(os.path.dirname(__file__), "ml_models/mdi_predictor_2d.joblib")
-    if os.path.exists(model_path):
-        ml_models["mastitis"] = joblib.load(model_path)
-        print(f"Model loaded from {model_path}")
+    # Load the ML model (and the other heavy dependencies).
+    # With FAST_START the app starts serving immediately and warms up in the background;
+    # /ready reports when the model and the Supabase client are available.
+    if is_fast_start_enabled():
+        start_background_warmup(ml_models)
     else:
-        print(f"Warning: Model not found at {model_path}")
+        warm_up(ml_models)
     
     yield
     
     # Clean up the ML models and release the resources
     ml_models.clear()
 
+def run_mdi_predictions(db: Client, farm_id: str, model, new_sessions_oid: list[int]):
+    """Imports the predictor (pandas, numpy) on first use, then runs it."""
+    from .predictor_service import process_mdi_predictions
+    with sampling_profiler.capture("process_mdi_predictions", kind="job", farm_id=farm_id):
+        process_mdi_predictions(db, farm_id, model, new_sessions_oid)
+
 app = FastAPI(title="Pecus Chain API", lifespan=lifespan)
+# Sync endpoints declared below attach their worker thread to CPU profiles
+app.router.route_class = ProfiledRoute
 
 # Configure CORS
 app.add_middleware(
@@ -45,6 +64,36 @@ app.add_middleware(
 )
 
 app.include_router(notification_router)
+app.include_router(distribution_router)
+app.include_router(timeseries_router)
+app.include_router(risk_router)
+app.include_router(query_profiler_router)
+app.include_router(sampling_profiler_router)
+
+@app.middleware("http")
+async def profile_supabase_queries(request: Request, call_next):
+    """
+    Collects every Supabase call made while serving the request.
+    Send X-Debug-Queries: 1 with a valid X-Debug-Token to get the breakdown
+    back in the X-Query-Profile header; recent profiles are also listed at /api/debug/queries.
+    Payload byte sizes are only measured for those debug requests.
+    """
+    debug = bool(request.headers.get("x-debug-queries")) and is_debug_request_allowed(request.headers.get("x-debug-token"))
+    profile = start_request_profile(request.method, request.url.path, measure_bytes=debug)
+    response = await call_next(request)
+    if debug:
+        response.headers["X-Query-Profile"] = header_summary(profile)
+    return response
+
+@app.middleware("http")
+async def sample_cpu_profile(request: Request, call_next):
+    """
+    Samples the request's CPU stacks while the profiler is armed for its path
+    or farm (see /api/debug/profiler); a no-op otherwise.
+    """
+    path = request.url.path
+    with sampling_profiler.capture(f"{request.method} {path}", path=path, farm_id=request.query_params.get("farm_id")):
+        return await call_next(request)
 
 security = HTTPBearer()
 
@@ -58,8 +107,15 @@ def read_root():
 
 @app.get("/health")
 def health_check():
+    """Liveness: answers as soon as the process is up, regardless of warm-up."""
     return {"status": "ok"}
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness: 200 once the Supabase client and model warm-up has finished, 503 before."""
+    report = readiness_report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
 # 0. Registration Endpoint
 @app.post("/api/v1/farms/register", response_model=FarmRegistrationResponse)
 def register_farm(request: FarmRegistrationRequest, db: Client = Depends(get_supabase_client)):
@@ -134,7 +190,10 @@ def get_sync_status(farm_id: str, db: Client = Depends(get_supabase_client)):
             "last_oid": last_oid,
             "last_animal_oid": last_animal_oid,
             "last_lactation_oid": last_lactation_oid,
-            "last_history_milk_diversion_oid": last_history_milk_diversion_oid
+            "last_history_milk_diversion_oid": last_history_milk_diversion_oid,
+            # Backpressure hints: smaller batches and slower polling while ingest is under load
+            "recommended_batch_size": ingest_admission.recommended_batch_size(),
+            "recommended_poll_interval_seconds": ingest_admission.recommended_poll_interval_seconds()
         }
 
         print(f"[SyncStatus] Returning OIDs for farm_id {farm_id}: {response_data}")
@@ -146,72 +205,153 @@ def get_sync_status(farm_id: str, db: Client = Depends(get_supabase_client)):
         raise HTTPException(status_code=500, detail=str(e))
 
 # 2. Ingest Endpoint: Receive Data from Agent
-@app.post("/api/v1/ingest")
-def ingest_data(payload: IngestPayload, background_tasks: BackgroundTasks, db: Client = Depends(get_supabase_client)):
+def _inline_schema_refs(schema: dict) -> dict:
+    """Inlines $defs references so the schema can sit directly in the OpenAPI requestBody."""
+    defs = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return resolve(defs[node["$ref"].split("/")[-1]])
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(value) for value in node]
+        return node
+
+    return resolve(schema)
+
+@app.post(
+    "/api/v1/ingest",
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/json": {"schema": _inline_schema_refs(IngestPayload.model_json_schema())}},
+            "required": True,
+        }
+    },
+)
+async def ingest_data(request: Request, background_tasks: BackgroundTasks, db: Client = Depends(get_supabase_client)):
+    # Sessions written before the model is loaded would never get predictions (and are skipped
+    # by change detection if re-sent), so refuse them until warm-up is done; the agent re-sends
+    # from its watermark on the next cycle
+    if is_warming_up():
+        raise HTTPException(
+            status_code=503,
+            detail="Service is warming up, retry shortly",
+            headers={"Retry-After": str(WARMUP_RETRY_AFTER_SECONDS)},
+        )
+    # Admission control: answers 429 with Retry-After when too much ingest work is in flight
+    # or the database is slow, instead of letting requests pile up and fail. The check only
+    # takes a short lock, so it runs here before the (possibly multi-MB) body is read
+    with ingest_admission.admit():
+        # The raw body is validated in one pass by pydantic's JSON parser straight into
+        # row dicts, instead of json.loads + model construction, see _ingest_raw_body
+        body = await request.body()
+        return await run_in_threadpool(_ingest_raw_body, body, background_tasks, db)
+
+def _ingest_raw_body(body: bytes, background_tasks: BackgroundTasks, db: Client):
+    try:
+        payload = INGEST_PAYLOAD_ADAPTER.validate_json(body)
+    except ValidationError as e:
+        # Same error locations as FastAPI's own body validation
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)],
+            body=body,
+        )
+    # The farm is only known from the body, so farm-filtered profiling of ingest starts here
+    with sampling_profiler.capture("POST /api/v1/ingest", path="/api/v1/ingest", farm_id=payload["farm_id"]):
+        return _ingest_payload(payload, background_tasks, db)
+
+def _table_rows(payload: dict, table: str) -> list[dict]:
+    """A table's validated rows, with the optional columns the agent left out set to None."""
+    defaults = INGEST_ROW_DEFAULTS[table]
+    return [{**defaults, **row} for row in payload[table]]
+
+def _upsert_changed_rows(db: Client, farm_id: str, table: str, records: list[dict]) -> tuple[list[dict], int]:
+    """
+    Upserts only the rows whose fingerprint differs from the last write.
+    Returns the written rows and the number of unchanged rows skipped.
+    """
+    for r in records: r["farm_id"] = farm_id
+    changed, fingerprints = row_fingerprints.filter_changed(farm_id, table, records)
+    if changed:
+        # Rows are the validated request JSON (timestamps and UUIDs as sent)
+        with ingest_admission.timed_write(len(changed)):
+            db.table(table).upsert(changed).execute()
+        row_fingerprints.remember(fingerprints)
+    return changed, len(records) - len(changed)
+
+def _ingest_payload(payload: dict, background_tasks: BackgroundTasks, db: Client):
     status_report = {}
+    skipped_report = {}
 
     try:
         # 1. Ingest Basic Animals
-        if payload.basic_animals:
-            records = [item.dict() for item in payload.basic_animals]
-            for r in records: r["farm_id"] = payload.farm_id
-            # Use jsonable_encoder to handle datetime serialization for Supabase
-            db.table("DELPRO_basic_animals").upsert(jsonable_encoder(records)).execute()
-            status_report["basic_animals"] = len(records)
+        if payload.get("basic_animals"):
+            records = _table_rows(payload, "basic_animals")
+            written, skipped = _upsert_changed_rows(db, payload["farm_id"], "DELPRO_basic_animals", records)
+            status_report["basic_animals"] = len(written)
+            skipped_report["basic_animals"] = skipped
 
         # 2. Ingest Lactations Summary
-        if payload.lactations_summary:
-            records = [item.dict() for item in payload.lactations_summary]
-            for r in records: r["farm_id"] = payload.farm_id
-            db.table("DELPRO_animals_lactations_summary").upsert(jsonable_encoder(records)).execute()
-            status_report["lactations_summary"] = len(records)
+        if payload.get("lactations_summary"):
+            records = _table_rows(payload, "lactations_summary")
+            written, skipped = _upsert_changed_rows(db, payload["farm_id"], "DELPRO_animals_lactations_summary", records)
+            status_report["lactations_summary"] = len(written)
+            skipped_report["lactations_summary"] = skipped
 
         # 3. Ingest Sessions Milk Yield
         sessions_oids = []
-        if payload.sessions_milk_yield:
-            records = [item.dict() for item in payload.sessions_milk_yield]
-            for r in records: r["farm_id"] = payload.farm_id
-            
-            # Upsert
-            db.table("DELPRO_sessions_milk_yield").upsert(jsonable_encoder(records)).execute()
-            status_report["sessions_milk_yield"] = len(records)
+        session_records = []
+        if payload.get("sessions_milk_yield"):
+            records = session_records = _table_rows(payload, "sessions_milk_yield")
+            written, skipped = _upsert_changed_rows(db, payload["farm_id"], "DELPRO_sessions_milk_yield", records)
+            status_report["sessions_milk_yield"] = len(written)
+            skipped_report["sessions_milk_yield"] = skipped
             
-            # Keep track of OIDs for processing
-            sessions_oids = [r["OID"] for r in records if r.get("OID")]
+            # Keep track of OIDs for processing (unchanged sessions were already predicted)
+            sessions_oids = [r["OID"] for r in written if r.get("OID")]
+
+            # Fold the new yields into the regional distribution sketches
+            if written:
+                background_tasks.add_task(update_yield_sketches, db, payload["farm_id"], written)
 
         # 4. Ingest Voluntary Sessions Milk Yield
-        if payload.voluntary_sessions_milk_yield:
-            records = [item.dict() for item in payload.voluntary_sessions_milk_yield]
-            for r in records: r["farm_id"] = payload.farm_id
-            db.table("DELPRO_voluntary_sessions_milk_yield").upsert(jsonable_encoder(records)).execute()
-            status_report["voluntary_sessions_milk_yield"] = len(records)
+        if payload.get("voluntary_sessions_milk_yield"):
+            records = _table_rows(payload, "voluntary_sessions_milk_yield")
+            written, skipped = _upsert_changed_rows(db, payload["farm_id"], "DELPRO_voluntary_sessions_milk_yield", records)
+            status_report["voluntary_sessions_milk_yield"] = len(written)
+            skipped_report["voluntary_sessions_milk_yield"] = skipped
+
+            # Per-quarter conductivity/blood/peak-flow change detection, O(1) per session
+            if written and session_records:
+                background_tasks.add_task(detect_quarter_deviations, db, payload["farm_id"], session_records, written)
 
         # 5. Ingest History Milk Diversion Info
-        if payload.history_milk_diversion_info:
-            records = [item.dict() for item in payload.history_milk_diversion_info]
-            for r in records: r["farm_id"] = payload.farm_id
-            db.table("DELPRO_history_milk_diversion_info").upsert(jsonable_encoder(records)).execute()
-            status_report["history_milk_diversion_info"] = len(records)
+        if payload.get("history_milk_diversion_info"):
+            records = _table_rows(payload, "history_milk_diversion_info")
+            written, skipped = _upsert_changed_rows(db, payload["farm_id"], "DELPRO_history_milk_diversion_info", records)
+            status_report["history_milk_diversion_info"] = len(written)
+            skipped_report["history_milk_diversion_info"] = skipped
 
         # 6. Ingest History Animals
-        if payload.history_animals:
-            records = [item.dict() for item in payload.history_animals]
-            for r in records: r["farm_id"] = payload.farm_id
-            db.table("DELPRO_history_animals").upsert(jsonable_encoder(records)).execute()
-            status_report["history_animals"] = len(records)
+        if payload.get("history_animals"):
+            records = _table_rows(payload, "history_animals")
+            written, skipped = _upsert_changed_rows(db, payload["farm_id"], "DELPRO_history_animals", records)
+            status_report["history_animals"] = len(written)
+            skipped_report["history_animals"] = skipped
 
         # --- Trigger Background Prediction ---
         # Only if we have new sessions and the model is loaded
         if sessions_oids and "mastitis" in ml_models:
             background_tasks.add_task(
-                process_mdi_predictions, 
+                run_mdi_predictions, 
                 db, 
-                payload.farm_id, 
+                payload["farm_id"], 
                 ml_models["mastitis"], 
                 sessions_oids
             )
         
-        return {"status": "success", "counts": status_report}
+        return {"status": "success", "counts": status_report, "skipped": skipped_report}
         
     except Exception as e:
         print(f"Error ingesting: {e}")
@@ -255,3 +395,5 @@ def predict_mastitis(input_data: PredictionInput, db: Client = Depends(get_curre
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+record_app_import_time(time.perf_counter() - _IMPORT_STARTED)
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, TypeAdapter, WrapValidator
+from typing import Annotated, Optional, List, get_args
+from typing_extensions import NotRequired, TypedDict
 from datetime import datetime
 from uuid import UUID
 
@@ -200,8 +201,51 @@ class IngestPayload(BaseModel):
     history_milk_diversion_info: List[DelproHistoryMilkDiversionInfo] = []
     history_animals: List[DelproHistoryAnimal] = []
 
+# --- Ingest fast path ---
+# Rows are validated straight from the request JSON into plain dicts, as the upsert
+# takes them, with the same field types as the models above. Timestamps and UUIDs
+# go through pydantic's own datetime/UUID validation but keep the string as sent,
+# so nothing is re-serialised.
+def _keep_input_string(value, handler):
+    validated = handler(value)
+    if isinstance(value, str):
+        return value
+    return validated.isoformat() if isinstance(validated, datetime) else str(validated)
+
+IsoTimestamp = Annotated[datetime, WrapValidator(_keep_input_string)]
+UuidString = Annotated[UUID, WrapValidator(_keep_input_string)]
+_ROW_FIELD_TYPES = {datetime: IsoTimestamp, UUID: UuidString}
+
+def _row_typeddict(model: type[BaseModel]) -> type:
+    """TypedDict with the fields of a row model; optional fields may be left out."""
+    fields = {}
+    for name, field in model.model_fields.items():
+        base = next((arg for arg in get_args(field.annotation) if arg is not type(None)), field.annotation)
+        row_type = _ROW_FIELD_TYPES.get(base, base)
+        fields[name] = row_type if field.is_required() else NotRequired[Optional[row_type]]
+    return TypedDict(f"{model.__name__}Row", fields)
+
+INGEST_TABLE_MODELS = {
+    name: get_args(field.annotation)[0]
+    for name, field in IngestPayload.model_fields.items()
+    if name != "farm_id"
+}
+
+# Optional columns missing from a row, filled with None so every row upserts the same columns
+INGEST_ROW_DEFAULTS = {
+    table: {name: None for name, field in model.model_fields.items() if not field.is_required()}
+    for table, model in INGEST_TABLE_MODELS.items()
+}
+
+INGEST_PAYLOAD_ADAPTER = TypeAdapter(TypedDict("IngestRows", {
+    "farm_id": str,
+    **{table: NotRequired[List[_row_typeddict(model)]] for table, model in INGEST_TABLE_MODELS.items()},
+}))
+
 class SyncStatusResponse(BaseModel):
     last_oid: int # Used for sessions watermark
     last_animal_oid: int # Used for basic animals watermark
     last_lactation_oid: int # Used for lactations watermark
     last_history_milk_diversion_oid: int = 0 # Used for history milk diversion watermark
+    recommended_batch_size: int = 2000 # Max rows per table the agent should send in the next upload
+    recommended_poll_interval_seconds: int = 60 # Min seconds the agent should wait before the next cycle
@@ -2,9 +2,9 @@ from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Optional
 import os
-from twilio.rest import Client
+from .sampling_profiler import ProfiledRoute
 
-router = APIRouter(prefix="/api/notifications", tags=["Notifications"])
+router = APIRouter(prefix="/api/notifications", tags=["Notifications"], route_class=ProfiledRoute)
 
 class SupabaseWebhookPayload(BaseModel):
     type: str
@@ -36,6 +36,8 @@ async def send_whatsapp_notification(request: WhatsappNotificationRequest):
             print("Missing Twilio credentials in environment variables.")
             raise HTTPException(status_code=500, detail="Twilio configuration missing")
 
+        # Imported here to keep twilio out of the app's cold start
+        from twilio.rest import Client
         client = Client(account_sid, auth_token)
 
         # Construct message
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from typing import Optional
 from supabase import Client
 import joblib
 # Try importing the probability service, handling both module and script execution contexts
@@ -16,6 +17,194 @@ except ImportError:
             print("Warning: Could not import probability_service. Probability calculation will be skipped.")
             def calculate_mastitis_probability(db, c, p): return None
 
+try:
+    from .feature_engineering import grouped_rolling_means
+    from .risk_cache import risk_cache
+    from . import archive_service
+except ImportError:
+    try:
+        from app.feature_engineering import grouped_rolling_means
+        from app.risk_cache import risk_cache
+        from app import archive_service
+    except ImportError:
+        from backend.app.feature_engineering import grouped_rolling_means
+        from backend.app.risk_cache import risk_cache
+        from backend.app import archive_service
+
+# Columns of the session/voluntary join the features are computed from
+SESSION_COLUMNS = ["OID", "BeginTime", "EndTime", "BasicAnimal", "TotalYield", "AvgConductivity", "MaxBlood", "ExpectedYield"]
+VOLUNTARY_COLUMNS = ["OID", "Mdi", "MilkFlowDuration", "SmartPulsationRatio", "CurrentCombinedAmd", "Incomplete", "Kickoff"]
+
+INSERT_CHUNK = 1000  # mdi_predictor_mastertable rows per insert
+PAGE_SIZE = 1000  # PostgREST default max rows per request
+BACKFILL_CONTEXT_DAYS = 7  # History read before each backfilled month for the moving averages, as the live path does
+
+def _predict_and_store(db: Client, farm_id: str, model, df: pd.DataFrame, target_oids: list[int]) -> int:
+    """
+    Features, inference and insert for the sessions in `target_oids`, given the
+    sessions joined with their voluntary rows on OID. The rest of `df` is
+    context for the moving averages. Returns the number of predictions saved.
+    """
+    df['BeginTime'] = pd.to_datetime(df['BeginTime'])
+    
+    # Sort by Animal and Time
+    df = df.sort_values(by=['BasicAnimal', 'BeginTime'])
+    
+    # 2. Calculate Moving Averages
+    # We need to calculate these per animal
+    
+    # Define window functions
+    # 15 sessions windows and 21 sessions windows (min_periods=1 semantics:
+    # if we have fewer sessions than the window, average whatever is available)
+    cols_15 = ['AvgConductivity', 'MaxBlood', 'Mdi', 'MilkFlowDuration', 'SmartPulsationRatio', 'CurrentCombinedAmd']
+    cols_21 = ['TotalYield', 'ExpectedYield']
+    
+    # All grouped rolling means in one vectorized pass (see feature_engineering)
+    df = grouped_rolling_means(df, 'BasicAnimal', {15: cols_15, 21: cols_21})
+    
+    # 3. Calculate Contextual Features (LactationNumber, DIM)
+    # Fetch Lactation Summary
+    res_lact = db.table("DELPRO_animals_lactations_summary")\
+        .select("Animal, LactationNumber, StartDate")\
+        .eq("farm_id", farm_id)\
+        .execute()
+        
+    df_lact = pd.DataFrame(res_lact.data)
+    
+    if not df_lact.empty:
+        # We want the *current* lactation for each session.
+        # Simple approximation: Merge on Animal and take the latest LactationNumber available
+        # A more precise way would be to check if BeginTime is between StartDate and EndDate.
+        
+        # Let's keep it simple: Get max lactation number for the animal
+        # (assuming we are processing recent data)
+        df_lact_max = df_lact.sort_values('LactationNumber', ascending=False).drop_duplicates('Animal')
+        df_lact_max = df_lact_max.rename(columns={'Animal': 'BasicAnimal'})
+        
+        df = pd.merge(df, df_lact_max[['BasicAnimal', 'LactationNumber', 'StartDate']], on='BasicAnimal', how='left')
+        
+        # Calculate DIM
+        df['StartDate'] = pd.to_datetime(df['StartDate'])
+        df['DIM'] = (df['BeginTime'] - df['StartDate']).dt.days
+        df['DIM'] = df['DIM'].fillna(0)
+    else:
+        df['LactationNumber'] = 0
+        df['DIM'] = 0
+
+    print(f"Rows after feature calculation: {df.head()}")
+    print(f"New sessions OID: {target_oids}")
+    # 4. Filter for ONLY the sessions we were asked to predict
+    # We calculated features on history, but we only want to predict/save for the new rows.
+    df_new = df[df['OID'].isin(target_oids)].copy()
+    
+    if df_new.empty:
+        print("No new sessions found after processing.")
+        return 0
+
+    # 5. Prepare for Prediction
+    # Select features expected by the model
+    # NOTE: You must ensure these match exactly what your .joblib model expects
+    feature_cols = [
+        "Mdi", "TotalYield", "AvgConductivity", "MaxBlood", "MilkFlowDuration", 
+        "SmartPulsationRatio", "CurrentCombinedAmd", "Incomplete", "Kickoff",
+        "AvgConductivity_ma15", "MaxBlood_ma15", "Mdi_ma15", "MilkFlowDuration_ma15",
+        "SmartPulsationRatio_ma15", "CurrentCombinedAmd_ma15", "TotalYield_ma21",
+        "ExpectedYield_ma21", "LactationNumber", "DIM"
+    ]
+    
+    # Handle missing values (NaN) - Simple imputation with 0
+    pd.set_option('future.no_silent_downcasting', True) # Opt-in to future behavior
+    X = df_new[feature_cols].fillna(0)
+    
+    # 6. Run Inference
+    try:
+        # Check feature names if model supports it (sklearn > 1.0)
+        if hasattr(model, "feature_names_in_"):
+            # Reorder columns to match model's expectations
+            X = X[model.feature_names_in_]
+        
+        predictions = model.predict(X)
+        df_new['mdi_2d'] = predictions
+        
+        # 6b. Calculate Mastitis Probability using the Logistic Regression Model
+        # We do this row by row (or vectorised if we refactored probability_service, but row-by-row is safer for now with the cache logic)
+        probs = []
+        for _, row in df_new.iterrows():
+            curr_mdi = row.get("Mdi")
+            pred_mdi = row.get("mdi_2d")
+            prob = calculate_mastitis_probability(db, curr_mdi, pred_mdi)
+            probs.append(prob)
+        df_new['prob_mastitis'] = probs
+        
+    except Exception as e:
+        print(f"Inference failed: {e}")
+        return 0
+
+    # 7. Save to Supabase (mdi_predictor_mastertable)
+    # Prepare records
+    records_to_insert = []
+    for _, row in df_new.iterrows():
+        record = {
+            "farm_id": farm_id,
+            "session_oid": int(row["OID"]),
+            "animal_oid": int(row["BasicAnimal"]),
+            
+            # Raw
+            "Mdi": row.get("Mdi"),
+            "TotalYield": row.get("TotalYield"),
+            "AvgConductivity": row.get("AvgConductivity"),
+            "MaxBlood": row.get("MaxBlood"),
+            "MilkFlowDuration": row.get("MilkFlowDuration"),
+            "SmartPulsationRatio": row.get("SmartPulsationRatio"),
+            "CurrentCombinedAmd": row.get("CurrentCombinedAmd"),
+            "Incomplete": int(row.get("Incomplete", 0)),
+            "Kickoff": int(row.get("Kickoff", 0)),
+            
+            # Calculated
+            "AvgConductivity_ma15": row.get("AvgConductivity_ma15"),
+            "MaxBlood_ma15": row.get("MaxBlood_ma15"),
+            "Mdi_ma15": row.get("Mdi_ma15"),
+            "MilkFlowDuration_ma15": row.get("MilkFlowDuration_ma15"),
+            "SmartPulsationRatio_ma15": row.get("SmartPulsationRatio_ma15"),
+            "CurrentCombinedAmd_ma15": row.get("CurrentCombinedAmd_ma15"),
+            "TotalYield_ma21": row.get("TotalYield_ma21"),
+            "ExpectedYield_ma21": row.get("ExpectedYield_ma21"),
+            
+            "LactationNumber": int(row.get("LactationNumber", 0)),
+            "DIM": row.get("DIM"),
+
+            # Times
+            # Pandas converts timestamps to Timestamp objects, but if they are already strings (from Supabase response)
+            # or if we converted them earlier.
+            # 'BeginTime' was converted to datetime at line ~95: df['BeginTime'] = pd.to_datetime(df['BeginTime'])
+            # But 'EndTime' might still be a string or object if we didn't explicitly convert it.
+            # Let's ensure we handle both cases safely.
+            
+            "BeginTime": row["BeginTime"].isoformat() if isinstance(row.get("BeginTime"), (pd.Timestamp, datetime)) else row.get("BeginTime"),
+            "EndTime": row["EndTime"].isoformat() if isinstance(row.get("EndTime"), (pd.Timestamp, datetime)) else row.get("EndTime"),
+            
+            # Prediction
+            "mdi_2d": row.get("mdi_2d"),
+            "prob_mastitis": row.get("prob_mastitis")
+        }
+        # Clean up NaNs/Infs for JSON serialization
+        for k, v in record.items():
+            if isinstance(v, float) and (np.isnan(v) or np.isinf(v)):
+                record[k] = None
+                
+        records_to_insert.append(record)
+
+    if records_to_insert:
+        for i in range(0, len(records_to_insert), INSERT_CHUNK):
+            db.table("mdi_predictor_mastertable").insert(records_to_insert[i:i + INSERT_CHUNK]).execute()
+        print(f"Successfully processed and saved {len(records_to_insert)} predictions.")
+
+        # Keep the in-memory "who needs attention now" ranking current
+        risk_cache.update_from_records(farm_id, records_to_insert)
+
+    return len(records_to_insert)
+
+
 def process_mdi_predictions(
     db: Client, 
     farm_id: str, 
@@ -58,7 +247,7 @@ def process_mdi_predictions(
         # Fetch Session Data (s)
         print("Fetching DELPRO_sessions_milk_yield...")
         res_s = db.table("DELPRO_sessions_milk_yield")\
-            .select("OID, BeginTime, EndTime, BasicAnimal, TotalYield, AvgConductivity, MaxBlood, ExpectedYield")\
+            .select(", ".join(SESSION_COLUMNS))\
             .eq("farm_id", farm_id)\
             .gte("BeginTime", cutoff_date)\
             .execute()
@@ -75,7 +264,7 @@ def process_mdi_predictions(
             print(f"Fetching data since {cutoff_date} (Strategy: Fallback)")
             
             res_s = db.table("DELPRO_sessions_milk_yield")\
-                .select("OID, BeginTime, EndTime, BasicAnimal, TotalYield, AvgConductivity, MaxBlood, ExpectedYield")\
+                .select(", ".join(SESSION_COLUMNS))\
                 .eq("farm_id", farm_id)\
                 .gte("BeginTime", cutoff_date)\
                 .execute()
@@ -99,7 +288,7 @@ def process_mdi_predictions(
         # Fetch voluntary data matching the session OIDs
         # Using .in_() to filter by OID list
         res_v = db.table("DELPRO_voluntary_sessions_milk_yield")\
-            .select("OID, Mdi, MilkFlowDuration, SmartPulsationRatio, CurrentCombinedAmd, Incomplete, Kickoff")\
+            .select(", ".join(VOLUNTARY_COLUMNS))\
             .eq("farm_id", farm_id)\
             .in_("OID", session_oids)\
             .execute()
@@ -114,172 +303,71 @@ def process_mdi_predictions(
         if df.empty:
             print("WARNING: Join resulted in 0 rows. Check if OIDs match between tables.")
             return
-        df['BeginTime'] = pd.to_datetime(df['BeginTime'])
-        
-        # Sort by Animal and Time
-        df = df.sort_values(by=['BasicAnimal', 'BeginTime'])
-        
-        # 2. Calculate Moving Averages
-        # We need to calculate these per animal
-        
-        # Define window functions
-        # 15 sessions windows (min_periods=1 means it will average whatever is available if < 15)
-        cols_15 = ['AvgConductivity', 'MaxBlood', 'Mdi', 'MilkFlowDuration', 'SmartPulsationRatio', 'CurrentCombinedAmd']
-        for col in cols_15:
-            if col in df.columns:
-                # rolling(window=15, min_periods=1) ensures that if we have fewer than 15 sessions, 
-                # we still compute the average of available sessions.
-                df[f'{col}_ma15'] = df.groupby('BasicAnimal')[col].transform(lambda x: x.rolling(window=15, min_periods=1).mean())
-        
-        # 21 sessions windows (min_periods=1 means it will average whatever is available if < 21)
-        cols_21 = ['TotalYield', 'ExpectedYield']
-        for col in cols_21:
-            if col in df.columns:
-                # rolling(window=21, min_periods=1) ensures that if we have fewer than 21 sessions, 
-                # we still compute the average of available sessions.
-                df[f'{col}_ma21'] = df.groupby('BasicAnimal')[col].transform(lambda x: x.rolling(window=21, min_periods=1).mean())
-        
-        # 3. Calculate Contextual Features (LactationNumber, DIM)
-        # Fetch Lactation Summary
-        res_lact = db.table("DELPRO_animals_lactations_summary")\
-            .select("Animal, LactationNumber, StartDate")\
-            .eq("farm_id", farm_id)\
-            .execute()
-            
-        df_lact = pd.DataFrame(res_lact.data)
-        
-        if not df_lact.empty:
-            # We want the *current* lactation for each session.
-            # Simple approximation: Merge on Animal and take the latest LactationNumber available
-            # A more precise way would be to check if BeginTime is between StartDate and EndDate.
-            
-            # Let's keep it simple: Get max lactation number for the animal
-            # (assuming we are processing recent data)
-            df_lact_max = df_lact.sort_values('LactationNumber', ascending=False).drop_duplicates('Animal')
-            df_lact_max = df_lact_max.rename(columns={'Animal': 'BasicAnimal'})
-            
-            df = pd.merge(df, df_lact_max[['BasicAnimal', 'LactationNumber', 'StartDate']], on='BasicAnimal', how='left')
-            
-            # Calculate DIM
-            df['StartDate'] = pd.to_datetime(df['StartDate'])
-            df['DIM'] = (df['BeginTime'] - df['StartDate']).dt.days
-            df['DIM'] = df['DIM'].fillna(0)
-        else:
-            df['LactationNumber'] = 0
-            df['DIM'] = 0
-
-        print(f"Rows after feature calculation: {df.head()}")
-        print(f"New sessions OID: {new_sessions_oid}")
-        # 4. Filter for ONLY the new sessions we just ingested
-        # We calculated features on history, but we only want to predict/save for the new rows.
-        df_new = df[df['OID'].isin(new_sessions_oid)].copy()
-        
-        if df_new.empty:
-            print("No new sessions found after processing.")
-            return
-
-        # 5. Prepare for Prediction
-        # Select features expected by the model
-        # NOTE: You must ensure these match exactly what your .joblib model expects
-        feature_cols = [
-            "Mdi", "TotalYield", "AvgConductivity", "MaxBlood", "MilkFlowDuration", 
-            "SmartPulsationRatio", "CurrentCombinedAmd", "Incomplete", "Kickoff",
-            "AvgConductivity_ma15", "MaxBlood_ma15", "Mdi_ma15", "MilkFlowDuration_ma15",
-            "SmartPulsationRatio_ma15", "CurrentCombinedAmd_ma15", "TotalYield_ma21",
-            "ExpectedYield_ma21", "LactationNumber", "DIM"
-        ]
-        
-        # Handle missing values (NaN) - Simple imputation with 0
-        pd.set_option('future.no_silent_downcasting', True) # Opt-in to future behavior
-        X = df_new[feature_cols].fillna(0)
-        
-        # 6. Run Inference
-        try:
-            # Check feature names if model supports it (sklearn > 1.0)
-            if hasattr(model, "feature_names_in_"):
-                # Reorder columns to match model's expectations
-                X = X[model.feature_names_in_]
-            
-            predictions = model.predict(X)
-            df_new['mdi_2d'] = predictions
-            
-            # 6b. Calculate Mastitis Probability using the Logistic Regression Model
-            # We do this row by row (or vectorised if we refactored probability_service, but row-by-row is safer for now with the cache logic)
-            probs = []
-            for _, row in df_new.iterrows():
-                curr_mdi = row.get("Mdi")
-                pred_mdi = row.get("mdi_2d")
-                prob = calculate_mastitis_probability(db, curr_mdi, pred_mdi)
-                probs.append(prob)
-            df_new['prob_mastitis'] = probs
-            
-        except Exception as e:
-            print(f"Inference failed: {e}")
-            return
 
-        # 7. Save to Supabase (mdi_predictor_mastertable)
-        # Prepare records
-        records_to_insert = []
-        for _, row in df_new.iterrows():
-            record = {
-                "farm_id": farm_id,
-                "session_oid": int(row["OID"]),
-                "animal_oid": int(row["BasicAnimal"]),
-                
-                # Raw
-                "Mdi": row.get("Mdi"),
-                "TotalYield": row.get("TotalYield"),
-                "AvgConductivity": row.get("AvgConductivity"),
-                "MaxBlood": row.get("MaxBlood"),
-                "MilkFlowDuration": row.get("MilkFlowDuration"),
-                "SmartPulsationRatio": row.get("SmartPulsationRatio"),
-                "CurrentCombinedAmd": row.get("CurrentCombinedAmd"),
-                "Incomplete": int(row.get("Incomplete", 0)),
-                "Kickoff": int(row.get("Kickoff", 0)),
-                
-                # Calculated
-                "AvgConductivity_ma15": row.get("AvgConductivity_ma15"),
-                "MaxBlood_ma15": row.get("MaxBlood_ma15"),
-                "Mdi_ma15": row.get("Mdi_ma15"),
-                "MilkFlowDuration_ma15": row.get("MilkFlowDuration_ma15"),
-                "SmartPulsationRatio_ma15": row.get("SmartPulsationRatio_ma15"),
-                "CurrentCombinedAmd_ma15": row.get("CurrentCombinedAmd_ma15"),
-                "TotalYield_ma21": row.get("TotalYield_ma21"),
-                "ExpectedYield_ma21": row.get("ExpectedYield_ma21"),
-                
-                "LactationNumber": int(row.get("LactationNumber", 0)),
-                "DIM": row.get("DIM"),
-
-                # Times
-                # Pandas converts timestamps to Timestamp objects, but if they are already strings (from Supabase response)
-                # or if we converted them earlier.
-                # 'BeginTime' was converted to datetime at line ~95: df['BeginTime'] = pd.to_datetime(df['BeginTime'])
-                # But 'EndTime' might still be a string or object if we didn't explicitly convert it.
-                # Let's ensure we handle both cases safely.
-                
-                "BeginTime": row["BeginTime"].isoformat() if isinstance(row.get("BeginTime"), (pd.Timestamp, datetime)) else row.get("BeginTime"),
-                "EndTime": row["EndTime"].isoformat() if isinstance(row.get("EndTime"), (pd.Timestamp, datetime)) else row.get("EndTime"),
-                
-                # Prediction
-                "mdi_2d": row.get("mdi_2d"),
-                "prob_mastitis": row.get("prob_mastitis")
-            }
-            # Clean up NaNs/Infs for JSON serialization
-            for k, v in record.items():
-                if isinstance(v, float) and (np.isnan(v) or np.isinf(v)):
-                    record[k] = None
-                    
-            records_to_insert.append(record)
-
-        if records_to_insert:
-            db.table("mdi_predictor_mastertable").insert(records_to_insert).execute()
-            print(f"Successfully processed and saved {len(records_to_insert)} predictions.")
+        _predict_and_store(db, farm_id, model, df, new_sessions_oid)
 
     except Exception as e:
         print(f"Error in process_mdi_predictions: {e}")
         import traceback
         traceback.print_exc()
 
+
+def _predicted_session_oids(db: Client, farm_id: str, start: datetime, end: datetime) -> set[int]:
+    oids = set()
+    last_id = 0
+    while True:
+        res = db.table("mdi_predictor_mastertable")\
+            .select("id, session_oid")\
+            .eq("farm_id", farm_id)\
+            .gte("BeginTime", start.isoformat())\
+            .lt("BeginTime", end.isoformat())\
+            .gt("id", last_id)\
+            .order("id")\
+            .limit(PAGE_SIZE)\
+            .execute()
+        oids.update(row["session_oid"] for row in res.data)
+        if len(res.data) < PAGE_SIZE:
+            return oids
+        last_id = res.data[-1]["id"]
+
+
+def backfill_predictions(db: Client, farm_id: str, model, months: Optional[list[str]] = None) -> dict:
+    """
+    Predicts the archived sessions of a farm that have no mastertable row yet,
+    one archived month (YYYY-MM) at a time, reading the session/voluntary join
+    from the Parquet archive instead of paging the hot tables.
+    """
+    if not model:
+        print("SKIPPING BACKFILL: model not loaded")
+        return {}
+
+    months = months or archive_service.archived_months(archive_service.SESSIONS_TABLE, farm_id)
+    saved = {}
+    for month in months:
+        # Naive like the agent's timestamps in the hot tables and the mastertable; the archive stores them as UTC
+        start = datetime.strptime(month, "%Y-%m")
+        end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+        df = archive_service.read_session_history(
+            farm_id,
+            start - timedelta(days=BACKFILL_CONTEXT_DAYS),
+            end,
+            session_columns=SESSION_COLUMNS,
+            voluntary_columns=VOLUNTARY_COLUMNS,
+        )
+        if df.empty:
+            saved[month] = 0
+            continue
+        for column in ("BeginTime", "EndTime"):
+            df[column] = df[column].dt.tz_convert(None)
+
+        in_month = df[(df["BeginTime"] >= start) & (df["BeginTime"] < end)]
+        done = _predicted_session_oids(db, farm_id, start, end)
+        target_oids = [int(oid) for oid in in_month["OID"] if int(oid) not in done]
+        print(f"[Backfill] {month}: {len(target_oids)} of {len(in_month)} archived sessions need a prediction.")
+        saved[month] = _predict_and_store(db, farm_id, model, df, target_oids) if target_oids else 0
+    return saved
+
 # Delete this part if the script is not executed manually
 
 if __name__ == "__main__":
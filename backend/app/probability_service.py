@@ -10,6 +10,34 @@ _CONFIG_CACHE = {
 
 CACHE_TTL_SECONDS = 300  # 5 minutes
 
+# Fallback default weights if no training has run yet
+# Heuristic defaults (Softer Curve):
+# Intercept: -4.5 (Base prob low)
+# MDI Coef: 2.0 (Instead of 4.0, makes curve less steep)
+# Predicted Coef: 0.5 (Gives some weight to prediction)
+
+# Example outputs with these defaults:
+# MDI=1.4 (Attention) -> -4.5 + 2.8 = -1.7 -> Sigmoid(-1.7) = 15% (Low risk)
+# MDI=2.0 (Alert)     -> -4.5 + 4.0 = -0.5 -> Sigmoid(-0.5) = 37% (Medium risk)
+# MDI=3.0 (Critical)  -> -4.5 + 6.0 = +1.5 -> Sigmoid(1.5)  = 81% (High risk)
+DEFAULT_MODEL_CONFIG = {
+    "intercept": -4.5,
+    "coef_current_mdi": 2.0,
+    "coef_predicted_mdi": 0.5
+}
+
+def read_latest_model_config(db: Client):
+    """
+    Latest system_model_config row, or None if no training has run yet.
+    Uncached; database errors propagate (the trainer must not version over history it can't see).
+    """
+    res = db.table("system_model_config")\
+        .select("*")\
+        .order("updated_at", desc=True)\
+        .limit(1)\
+        .execute()
+    return res.data[0] if res.data else None
+
 def get_latest_model_config(db: Client):
     """
     Fetches the latest logistic regression coefficients from system_model_config.
@@ -22,43 +50,23 @@ def get_latest_model_config(db: Client):
         return _CONFIG_CACHE["data"]
     
     try:
-        # Fetch the latest config ordered by updated_at desc
-        res = db.table("system_model_config")\
-            .select("*")\
-            .order("updated_at", desc=True)\
-            .limit(1)\
-            .execute()
-        
-        if res.data:
-            config = res.data[0]
+        config = read_latest_model_config(db)
+        if config:
             _CONFIG_CACHE["data"] = config
             _CONFIG_CACHE["expires_at"] = now + CACHE_TTL_SECONDS
             return config
         else:
-            # Fallback default weights if no training has run yet
-            # Heuristic defaults (Softer Curve): 
-            # Intercept: -4.5 (Base prob low)
-            # MDI Coef: 2.0 (Instead of 4.0, makes curve less steep)
-            # Predicted Coef: 0.5 (Gives some weight to prediction)
-            
-            # Example outputs with these defaults:
-            # MDI=1.4 (Attention) -> -4.5 + 2.8 = -1.7 -> Sigmoid(-1.7) = 15% (Low risk)
-            # MDI=2.0 (Alert)     -> -4.5 + 4.0 = -0.5 -> Sigmoid(-0.5) = 37% (Medium risk)
-            # MDI=3.0 (Critical)  -> -4.5 + 6.0 = +1.5 -> Sigmoid(1.5)  = 81% (High risk)
-            return {
-                "intercept": -4.5,
-                "coef_current_mdi": 2.0, 
-                "coef_predicted_mdi": 0.5
-            }
+            return dict(DEFAULT_MODEL_CONFIG)
             
     except Exception as e:
         print(f"Error fetching model config: {e}")
         # Return safe defaults in case of DB error
-        return {
-            "intercept": -4.5,
-            "coef_current_mdi": 2.0, 
-            "coef_predicted_mdi": 0.5
-        }
+        return dict(DEFAULT_MODEL_CONFIG)
+
+def invalidate_model_config_cache():
+    """Forces the next lookup to re-read system_model_config (e.g. after retraining)."""
+    _CONFIG_CACHE["data"] = None
+    _CONFIG_CACHE["expires_at"] = 0
 
 def calculate_mastitis_probability(db: Client, current_mdi: float, predicted_mdi: float) -> float:
     """
@@ -0,0 +1,194 @@
+from typing import Optional
+from .database import Client
+
+QUARTERS = ("LF", "RF", "LR", "RR")
+
+# Per-quarter signals and the direction that indicates infection (+1 rise, -1 drop)
+SIGNALS = {
+    "Conductivity": 1,
+    "Blood": 1,
+    "PeakFlow": -1,
+}
+
+EWMA_ALPHA = 0.1          # ~10 session memory for the quarter baseline
+MIN_OBSERVATIONS = 10     # sessions needed before a quarter can be flagged
+Z_THRESHOLD = 3.0         # single-session spike
+CUSUM_K = 0.5             # allowance (in standard deviations) of the one-sided CUSUM
+CUSUM_H = 4.0             # decision interval of the CUSUM, catches smaller persistent shifts
+LEVEL_SHIFT_FLAGS = 5     # consecutive flags after which the baseline follows the new level again
+MIN_STD = {"Conductivity": 0.1, "Blood": 0.01, "PeakFlow": 0.05}
+
+DEVIATIONS_TABLE = "mdi_quarter_deviations"
+STATE_TABLE = "mdi_quarter_detector_state"  # see backend/sql/quarter_detector.sql
+
+ANIMAL_CHUNK = 200  # animals per in_() filter; one state row per animal keeps pages under the row cap
+
+
+class _QuarterState:
+    __slots__ = ("mean", "var", "n", "cusum", "flagged_run")
+
+    def __init__(self, mean: float = 0.0, var: float = 0.0, n: int = 0, cusum: float = 0.0, flagged_run: int = 0):
+        self.mean = mean
+        self.var = var
+        self.n = n
+        self.cusum = cusum
+        self.flagged_run = flagged_run  # consecutive flagged sessions
+
+    def to_list(self) -> list:
+        return [self.mean, self.var, self.n, self.cusum, self.flagged_run]
+
+
+class AnimalQuarterState:
+    """
+    Online detector state of one animal. Each (signal, quarter) keeps an
+    EWMA baseline and variance plus a one-sided CUSUM of standardised
+    residuals; one session is an O(1) update. Spikes don't move the
+    baseline, so a developing infection doesn't become the new normal, until
+    LEVEL_SHIFT_FLAGS sessions in a row are flagged: a lasting step (sensor
+    swap, quarter settling at a new level) is then reported that many times
+    and the baseline adapts to it.
+    `last_session_oid` is the newest session applied, so re-sent sessions are not counted twice.
+    """
+
+    def __init__(self, quarters: Optional[dict] = None, last_session_oid: Optional[int] = None):
+        self.quarters: dict[tuple[str, str], _QuarterState] = quarters or {}
+        self.last_session_oid = last_session_oid
+
+    def update(self, session_oid: int, values: dict) -> list[dict]:
+        """
+        Feeds one session's per-quarter values (e.g. values["ConductivityLF"]).
+        Returns the deviations flagged for this session; sessions at or before
+        last_session_oid were already applied and are skipped.
+        """
+        if self.last_session_oid is not None and session_oid <= self.last_session_oid:
+            return []
+        self.last_session_oid = session_oid
+
+        flags = []
+        for signal, direction in SIGNALS.items():
+            for quarter in QUARTERS:
+                value = values.get(f"{signal}{quarter}")
+                if value is None:
+                    continue
+                state = self.quarters.setdefault((signal, quarter), _QuarterState())
+                flag = self._update_one(state, signal, direction, float(value))
+                if flag is not None:
+                    flags.append({"quarter": quarter, "signal": signal, **flag})
+        return flags
+
+    @staticmethod
+    def _update_one(state: _QuarterState, signal: str, direction: int, value: float) -> Optional[dict]:
+        if state.n == 0:
+            state.mean, state.var, state.n = value, 0.0, 1
+            return None
+
+        std = max(state.var ** 0.5, MIN_STD[signal])
+        z = direction * (value - state.mean) / std
+        flagged = None
+
+        if state.n >= MIN_OBSERVATIONS:
+            state.cusum = max(0.0, state.cusum + z - CUSUM_K)
+            if z >= Z_THRESHOLD or state.cusum >= CUSUM_H:
+                flagged = {
+                    "value": value,
+                    "baseline": state.mean,
+                    "z_score": round(z, 3),
+                    "cusum": round(state.cusum, 3),
+                }
+                # Restart the CUSUM so a persistent shift is reported once, not every session
+                state.cusum = 0.0
+
+        state.flagged_run = state.flagged_run + 1 if flagged is not None else 0
+        if flagged is None or z < Z_THRESHOLD or state.flagged_run >= LEVEL_SHIFT_FLAGS:
+            # Exponentially weighted mean/variance update
+            diff = value - state.mean
+            increment = EWMA_ALPHA * diff
+            state.mean += increment
+            state.var = (1 - EWMA_ALPHA) * (state.var + diff * increment)
+        state.n += 1
+        return flagged
+
+    def to_dict(self) -> dict:
+        return {f"{signal}:{quarter}": state.to_list() for (signal, quarter), state in self.quarters.items()}
+
+    @classmethod
+    def from_row(cls, row: dict) -> "AnimalQuarterState":
+        quarters = {}
+        for key, values in (row.get("state") or {}).items():
+            signal, quarter = key.split(":")
+            flagged_run = int(values[4]) if len(values) > 4 else 0
+            quarters[(signal, quarter)] = _QuarterState(
+                float(values[0]), float(values[1]), int(values[2]), float(values[3]), flagged_run
+            )
+        return cls(quarters, row.get("last_session_oid"))
+
+
+def load_animal_states(db: Client, farm_id: str, animal_oids: list[int]) -> dict[int, AnimalQuarterState]:
+    """Persisted detector state of the given animals; animals without a row start empty."""
+    states = {}
+    for i in range(0, len(animal_oids), ANIMAL_CHUNK):
+        res = db.table(STATE_TABLE)\
+            .select("animal_oid, state, last_session_oid")\
+            .eq("farm_id", farm_id)\
+            .in_("animal_oid", animal_oids[i:i + ANIMAL_CHUNK])\
+            .execute()
+        for row in res.data:
+            states[int(row["animal_oid"])] = AnimalQuarterState.from_row(row)
+    return {oid: states.get(oid) or AnimalQuarterState() for oid in animal_oids}
+
+
+def detect_quarter_deviations(db: Client, farm_id: str, session_records: list[dict], voluntary_records: list[dict]):
+    """
+    Runs the detector over freshly ingested voluntary sessions, in BeginTime
+    order per animal, and stores flagged quarters in mdi_quarter_deviations
+    keyed by session_oid, alongside the mdi_predictor_mastertable rows.
+    Voluntary rows are matched to their animal through the session with the same OID.
+
+    Detector state is loaded from mdi_quarter_detector_state for the animals
+    in the batch and saved back with the deviations, so it survives restarts
+    and is shared by every instance.
+    """
+    sessions_by_oid = {r["OID"]: r for r in session_records if r.get("OID") is not None}
+    matched = [
+        (sessions_by_oid[v["OID"]], v)
+        for v in voluntary_records
+        if v.get("OID") in sessions_by_oid and sessions_by_oid[v["OID"]].get("BasicAnimal") is not None
+    ]
+    if not matched:
+        return
+    matched.sort(key=lambda sv: (sv[0]["BasicAnimal"], str(sv[0].get("BeginTime") or ""), sv[0]["OID"]))
+
+    try:
+        states = load_animal_states(db, farm_id, sorted({int(s["BasicAnimal"]) for s, _ in matched}))
+    except Exception as e:
+        print(f"[QuarterDetector] Failed to load detector state for farm {farm_id}: {e}")
+        return
+
+    rows = []
+    for session, voluntary in matched:
+        animal_oid = int(session["BasicAnimal"])
+        for flag in states[animal_oid].update(int(session["OID"]), voluntary):
+            begin_time = session.get("BeginTime")
+            rows.append({
+                "farm_id": farm_id,
+                "session_oid": int(session["OID"]),
+                "animal_oid": animal_oid,
+                "BeginTime": begin_time.isoformat() if hasattr(begin_time, "isoformat") else begin_time,
+                **flag,
+            })
+
+    try:
+        if rows:
+            db.table(DEVIATIONS_TABLE).insert(rows).execute()
+            print(f"[QuarterDetector] Flagged {len(rows)} quarter deviations for farm {farm_id}.")
+        db.table(STATE_TABLE).upsert([
+            {
+                "farm_id": farm_id,
+                "animal_oid": animal_oid,
+                "state": state.to_dict(),
+                "last_session_oid": state.last_session_oid,
+            }
+            for animal_oid, state in states.items()
+        ], on_conflict="farm_id,animal_oid").execute()
+    except Exception as e:
+        print(f"[QuarterDetector] Failed to save quarter deviations for farm {farm_id}: {e}")
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import threading
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import APIRouter, Depends
+from .debug_auth import require_debug_token
+
+router = APIRouter(prefix="/api/debug", tags=["Debug"], dependencies=[Depends(require_debug_token)])
+
+# Queries slower than this are logged as they happen
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "500"))
+
+# Same query shape executed at least this many times in one request is flagged (N+1 pattern)
+REPEATED_QUERY_THRESHOLD = int(os.environ.get("REPEATED_QUERY_THRESHOLD", "3"))
+
+# Number of finished request profiles kept for /api/debug/queries
+QUERY_PROFILE_HISTORY = int(os.environ.get("QUERY_PROFILE_HISTORY", "100"))
+
+# Builder methods that pick the operation; everything else is recorded as a filter/modifier
+_OPERATIONS = {"select", "insert", "upsert", "update", "delete"}
+
+_MAX_VALUE_CHARS = 80
+
+
+class RequestQueryProfile:
+    """All Supabase calls made while serving one request (including its background tasks)."""
+
+    def __init__(self, method: str, path: str, measure_bytes: bool = False):
+        self.method = method
+        self.path = path
+        # Payload sizes cost a JSON serialisation per query, so only debug-selected requests pay for them
+        self.measure_bytes = measure_bytes
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def add(self, entry: dict):
+        with self._lock:
+            self.queries.append(entry)
+
+    def summary(self) -> dict:
+        with self._lock:
+            queries = list(self.queries)
+        shapes = Counter(q["shape"] for q in queries)
+        return {
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "query_count": len(queries),
+            "total_ms": round(sum(q["latency_ms"] for q in queries), 2),
+            "slow_queries": sum(1 for q in queries if q["slow"]),
+            "repeated_shapes": [
+                {"shape": shape, "count": count}
+                for shape, count in shapes.items()
+                if count >= REPEATED_QUERY_THRESHOLD
+            ],
+            "queries": queries,
+        }
+
+
+_CURRENT_PROFILE: ContextVar[Optional[RequestQueryProfile]] = ContextVar("query_profile", default=None)
+
+_RECENT_PROFILES: deque = deque(maxlen=QUERY_PROFILE_HISTORY)
+
+
+def start_request_profile(method: str, path: str, measure_bytes: bool = False) -> RequestQueryProfile:
+    profile = RequestQueryProfile(method, path, measure_bytes)
+    _CURRENT_PROFILE.set(profile)
+    _RECENT_PROFILES.append(profile)
+    return profile
+
+
+def header_summary(profile: RequestQueryProfile) -> str:
+    """Compact one-line breakdown for the X-Query-Profile response header."""
+    summary = profile.summary()
+    return json.dumps({
+        "count": summary["query_count"],
+        "total_ms": summary["total_ms"],
+        "slow": summary["slow_queries"],
+        "repeated": summary["repeated_shapes"],
+        "queries": [
+            f"{q['operation']} {q['table']} {q['latency_ms']}ms rows={q['rows']}"
+            for q in summary["queries"]
+        ],
+    }, separators=(",", ":"))
+
+
+def _short(value) -> str:
+    if isinstance(value, (list, tuple, set)):
+        return f"<{len(value)} values>"
+    text = str(value)
+    return text if len(text) <= _MAX_VALUE_CHARS else text[:_MAX_VALUE_CHARS] + "..."
+
+
+def _measuring_bytes() -> bool:
+    profile = _CURRENT_PROFILE.get()
+    return profile is not None and profile.measure_bytes
+
+
+def _payload_bytes(data) -> Optional[int]:
+    """Serialised size of a payload, or None unless the current request measures sizes."""
+    if not _measuring_bytes():
+        return None
+    if data is None:
+        return 0
+    try:
+        return len(json.dumps(data, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _QueryRecord:
+    """Operation and filters accumulated along one builder chain."""
+
+    def __init__(self, table: str):
+        self.table = table
+        self.operation = None
+        self.filters = []
+        self.filter_names = []
+        self.request_bytes = None
+
+    def record(self, name: str, args: tuple, kwargs: dict):
+        if name in _OPERATIONS and self.operation is None:
+            self.operation = name
+            if name in ("insert", "upsert", "update") and args:
+                self.request_bytes = _payload_bytes(args[0])
+            elif name == "select" and args:
+                columns = ", ".join(map(str, args))
+                self.filters.append(f"select({_short(columns)})")
+                self.filter_names.append(f"select({columns})")
+            return
+        column = args[0] if args else ""
+        values = ", ".join(_short(a) for a in args[1:])
+        self.filters.append(f"{name}({column}{'=' + values if values else ''})")
+        self.filter_names.append(f"{name}({column})")
+
+    def shape(self) -> str:
+        return f"{self.operation or 'rpc'} {self.table} " + " ".join(self.filter_names)
+
+
+class _ProfiledQuery:
+    """Wraps a postgrest request builder and times its execute()."""
+
+    def __init__(self, builder, record: _QueryRecord):
+        self._builder = builder
+        self._record = record
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            # Properties such as `not_` return a builder
+            return _ProfiledQuery(attr, self._record) if hasattr(attr, "execute") else attr
+
+        def call(*args, **kwargs):
+            self._record.record(name, args, kwargs)
+            result = attr(*args, **kwargs)
+            return _ProfiledQuery(result, self._record) if hasattr(result, "execute") else result
+        return call
+
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        error = None
+        try:
+            res = self._builder.execute(*args, **kwargs)
+            return res
+        except Exception as e:
+            error = str(e)
+            res = None
+            raise
+        finally:
+            _record_execution(self._record, res, (time.perf_counter() - start) * 1000, error)
+
+
+def _record_execution(record: _QueryRecord, res, latency_ms: float, error: Optional[str]):
+    data = getattr(res, "data", None)
+    rows = len(data) if isinstance(data, list) else (1 if data else 0)
+    entry = {
+        "table": record.table,
+        "operation": record.operation or "rpc",
+        "filters": record.filters,
+        "shape": record.shape(),
+        "rows": rows,
+        "request_bytes": record.request_bytes,
+        "response_bytes": _payload_bytes(data),
+        "latency_ms": round(latency_ms, 2),
+        "slow": latency_ms >= SLOW_QUERY_MS,
+        "error": error,
+    }
+
+    if entry["slow"]:
+        print(f"[QueryProfiler] Slow query ({entry['latency_ms']}ms, {rows} rows): {entry['operation']} {record.table} {' '.join(record.filters)}")
+
+    profile = _CURRENT_PROFILE.get()
+    if profile is not None:
+        profile.add(entry)
+
+
+class ProfiledClient:
+    """
+    Drop-in wrapper around a Supabase client that records every table/rpc
+    call into the current request's profile. Other attributes pass through.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def table(self, table_name: str):
+        return _ProfiledQuery(self._client.table(table_name), _QueryRecord(table_name))
+
+    def from_(self, table_name: str):
+        return self.table(table_name)
+
+    def rpc(self, fn: str, params: Optional[dict] = None, *args, **kwargs):
+        record = _QueryRecord(fn)
+        record.operation = "rpc"
+        record.request_bytes = _payload_bytes(params)
+        return _ProfiledQuery(self._client.rpc(fn, params or {}, *args, **kwargs), record)
+
+
+@router.get("/queries")
+def get_recent_query_profiles(path: Optional[str] = None, limit: int = 20):
+    """Per-request Supabase call breakdowns, most recent first."""
+    profiles = [
+        p for p in reversed(_RECENT_PROFILES)
+        if p.queries and (path is None or p.path.startswith(path))
+    ]
+    return [p.summary() for p in profiles[:limit]]
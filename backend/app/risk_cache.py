@@ -0,0 +1,247 @@
+import time
+import bisect
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from .database import Client, get_supabase_client, get_authenticated_supabase_client
+from .sampling_profiler import ProfiledRoute
+
+router = APIRouter(prefix="/api/v1/webapp/risk", tags=["Risk"], route_class=ProfiledRoute)
+
+security = HTTPBearer()
+
+# How far back a rebuild or refresh looks for an animal's latest prediction
+REBUILD_LOOKBACK_DAYS = 30
+# A farm's ranking is reloaded from the mastertable when older than this, so predictions
+# made by other instances show up without a restart
+FARM_REFRESH_SECONDS = 60
+PAGE_SIZE = 1000  # PostgREST default max rows per request
+LATEST_RISK_RPC = "get_latest_risk_per_animal"  # see backend/sql/risk_cache.sql
+
+MAX_TOP_K = 200
+
+_MIN_TIME = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _parse_begin_time(value) -> datetime:
+    """Aware datetime of a BeginTime, whether an isoformat() string without offset or a PostgREST timestamptz."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return _MIN_TIME
+    if not isinstance(value, datetime):
+        return _MIN_TIME
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class FarmRiskIndex:
+    """
+    Latest prediction per animal of one farm, plus a ranking kept sorted by
+    descending prob_mastitis so the top-K is a slice.
+    """
+
+    def __init__(self):
+        self.latest: dict[int, dict] = {}
+        self._begin_times: dict[int, datetime] = {}
+        self._ranking: list[tuple[float, int]] = []  # (-prob_mastitis, animal_oid)
+        self.refreshed_at: Optional[str] = None
+        self._loaded_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > FARM_REFRESH_SECONDS
+
+    @staticmethod
+    def _rank_key(entry: dict) -> Optional[tuple[float, int]]:
+        prob = entry.get("prob_mastitis")
+        return None if prob is None else (-float(prob), entry["animal_oid"])
+
+    def update(self, entry: dict) -> bool:
+        """Replaces the animal's entry if this prediction is newer. Returns True if it did."""
+        current = self.latest.get(entry["animal_oid"])
+        begin_time = _parse_begin_time(entry.get("BeginTime"))
+        if current is not None and self._begin_times[entry["animal_oid"]] > begin_time:
+            return False
+
+        if current is not None:
+            old_key = self._rank_key(current)
+            if old_key is not None:
+                i = bisect.bisect_left(self._ranking, old_key)
+                if i < len(self._ranking) and self._ranking[i] == old_key:
+                    del self._ranking[i]
+
+        self.latest[entry["animal_oid"]] = entry
+        self._begin_times[entry["animal_oid"]] = begin_time
+        new_key = self._rank_key(entry)
+        if new_key is not None:
+            bisect.insort(self._ranking, new_key)
+        return True
+
+    def top(self, k: int) -> list[dict]:
+        return [self.latest[animal_oid] for _, animal_oid in self._ranking[:k]]
+
+
+class RiskCache:
+    """
+    Per-farm FarmRiskIndex, fed by process_mdi_predictions on this instance,
+    rebuilt from the mastertable on startup and reloaded per farm once it is
+    older than FARM_REFRESH_SECONDS.
+    """
+
+    def __init__(self):
+        self._farms: dict[str, FarmRiskIndex] = {}
+        self._farm_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.rebuilt_at: Optional[str] = None
+
+    @staticmethod
+    def _entry(record: dict) -> Optional[dict]:
+        if record.get("animal_oid") is None:
+            return None
+        return {
+            "animal_oid": int(record["animal_oid"]),
+            "session_oid": record.get("session_oid"),
+            "BeginTime": record.get("BeginTime"),
+            "Mdi": record.get("Mdi"),
+            "mdi_2d": record.get("mdi_2d"),
+            "prob_mastitis": record.get("prob_mastitis"),
+        }
+
+    @staticmethod
+    def _farm_ids(db: Client) -> list[str]:
+        farm_ids = []
+        last_id = None
+        while True:
+            query = db.table("farms").select("id")
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            res = query.order("id").limit(PAGE_SIZE).execute()
+            farm_ids.extend(row["id"] for row in res.data)
+            if len(res.data) < PAGE_SIZE:
+                return farm_ids
+            last_id = res.data[-1]["id"]
+
+    def _load_farm(self, db: Client, farm_id: str, lookback_days: int = REBUILD_LOOKBACK_DAYS) -> FarmRiskIndex:
+        """Latest prediction of every animal of the farm through get_latest_risk_per_animal (distinct on animal)."""
+        since = (datetime.now(timezone.utc) - timedelta(days=lookback_days)).isoformat()
+        index = FarmRiskIndex()
+        last_animal = None
+        while True:
+            res = db.rpc(LATEST_RISK_RPC, {
+                "p_farm_id": farm_id,
+                "p_since": since,
+                "p_after_animal": last_animal,
+                "p_limit": PAGE_SIZE,
+            }).execute()
+            for record in res.data:
+                entry = self._entry(record)
+                if entry is not None:
+                    index.update(entry)
+            if len(res.data) < PAGE_SIZE:
+                break
+            last_animal = res.data[-1]["animal_oid"]
+        index.refreshed_at = datetime.now(timezone.utc).isoformat()
+        return index
+
+    def _install(self, farm_id: str, loaded: FarmRiskIndex):
+        """Swaps in a freshly loaded index. Caller holds the lock."""
+        # Predictions that arrived while we were reading may be newer than the snapshot; keep them
+        current = self._farms.get(farm_id)
+        if current is not None:
+            for entry in current.latest.values():
+                loaded.update(entry)
+        self._farms[farm_id] = loaded
+
+    def update_from_records(self, farm_id: str, records: list[dict]):
+        with self._lock:
+            index = self._farms.get(str(farm_id))
+            if index is None:
+                # Not loaded yet: the first top() reads the whole farm, including these rows
+                return
+            for record in records:
+                entry = self._entry(record)
+                if entry is not None:
+                    index.update(entry)
+
+    def refresh_farm(self, db: Client, farm_id: str):
+        """Reloads one farm unless another caller just did; concurrent callers wait for one load."""
+        farm_id = str(farm_id)
+        with self._lock:
+            farm_lock = self._farm_locks.setdefault(farm_id, threading.Lock())
+        with farm_lock:
+            index = self._farms.get(farm_id)
+            if index is not None and not index.is_stale():
+                return
+            loaded = self._load_farm(db, farm_id)
+            with self._lock:
+                self._install(farm_id, loaded)
+
+    def top(self, db: Client, farm_id: str, k: int) -> tuple[list[dict], int, Optional[str]]:
+        farm_id = str(farm_id)
+        index = self._farms.get(farm_id)
+        if index is None or index.is_stale():
+            try:
+                self.refresh_farm(db, farm_id)
+            except Exception as e:
+                if index is None:
+                    raise
+                # Serve the last ranking rather than failing the dashboard
+                print(f"[RiskCache] Failed to refresh farm {farm_id}, serving ranking from {index.refreshed_at}: {e}")
+        with self._lock:
+            index = self._farms[farm_id]
+            return index.top(k), len(index.latest), index.refreshed_at
+
+    def rebuild(self, db: Client, lookback_days: int = REBUILD_LOOKBACK_DAYS):
+        """
+        Reloads every farm, one at a time, reading one row per animal
+        instead of the whole lookback window.
+        """
+        rows_read = 0
+        farms = 0
+        for farm_id in self._farm_ids(db):
+            loaded = self._load_farm(db, farm_id, lookback_days)
+            rows_read += len(loaded.latest)
+            farms += 1
+            with self._lock:
+                self._install(str(farm_id), loaded)
+        self.rebuilt_at = datetime.now(timezone.utc).isoformat()
+        print(f"[RiskCache] Rebuilt from {rows_read} latest predictions across {farms} farms.")
+
+
+risk_cache = RiskCache()
+
+
+@router.get("/top")
+def get_top_risk_animals(
+    farm_id: str,
+    k: int = Query(20, ge=1, le=MAX_TOP_K),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Client = Depends(get_supabase_client),
+):
+    """
+    The K animals with the highest latest prob_mastitis on the farm, served
+    from memory and reloaded when older than FARM_REFRESH_SECONDS. Access is
+    checked by reading the farm through the caller's RLS client.
+    """
+    try:
+        user_db = get_authenticated_supabase_client(credentials.credentials)
+        res = user_db.table("farms").select("id").eq("id", farm_id).limit(1).execute()
+    except Exception as e:
+        print(f"[RiskCache] Error checking access to farm {farm_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not res.data:
+        raise HTTPException(status_code=404, detail="Farm not found")
+
+    try:
+        animals, tracked, refreshed_at = risk_cache.top(db, farm_id, k)
+    except Exception as e:
+        print(f"[RiskCache] Error loading farm {farm_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "farm_id": farm_id,
+        "tracked_animals": tracked,
+        "refreshed_at": refreshed_at,
+        "animals": animals,
+    }
@@ -0,0 +1,381 @@
+import os
+import sys
+import asyncio
+import functools
+import time
+import threading
+import itertools
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Callable, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from .debug_auth import require_debug_token
+
+router = APIRouter(prefix="/api/debug/profiler", tags=["Debug"], dependencies=[Depends(require_debug_token)])
+
+# Number of finished CPU profiles kept for download
+PROFILER_HISTORY = int(os.environ.get("PROFILER_HISTORY", "20"))
+
+# Default time between two stack samples
+PROFILER_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILER_SAMPLE_INTERVAL_MS", "5"))
+
+MAX_ARM_SECONDS = 3600
+MAX_STACKS_PER_PROFILE = 5000  # distinct stacks; further ones are counted under [truncated]
+MAX_STACK_DEPTH = 128
+
+
+class Capture:
+    """Collapsed-stack sample counts for one request, background job or time window."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, label: str, kind: str, farm_id: Optional[str] = None, all_threads: bool = False):
+        self.id = next(self._ids)
+        self.label = label
+        self.kind = kind
+        self.farm_id = farm_id
+        self.all_threads = all_threads
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.duration_ms: Optional[float] = None
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.threads: Counter = Counter()  # thread id -> number of scopes attached to this capture
+        self.finished = False
+        self._started = time.perf_counter()
+
+    def finish(self):
+        self.finished = True
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 2)
+
+    def add_sample(self, stack: str):
+        if stack not in self.stacks and len(self.stacks) >= MAX_STACKS_PER_PROFILE:
+            stack = "[truncated]"
+        self.stacks[stack] += 1
+        self.samples += 1
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "label": self.label,
+            "kind": self.kind,
+            "farm_id": self.farm_id,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks),
+        }
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's folded format ("frame;frame;frame count"), read by flamegraph.pl and speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class _Arm:
+    def __init__(self, path_prefix: Optional[str], farm_id: Optional[str], seconds: float,
+                 max_profiles: int, include_jobs: bool, interval_ms: float):
+        self.path_prefix = path_prefix
+        self.farm_id = farm_id
+        self.expires_at = time.monotonic() + seconds
+        self.remaining = max_profiles
+        self.include_jobs = include_jobs
+        self.interval_ms = interval_ms
+
+    def matches(self, kind: str, path: Optional[str], farm_id: Optional[str]) -> bool:
+        if self.farm_id is not None and str(farm_id) != self.farm_id:
+            return False
+        if kind == "job":
+            return self.include_jobs
+        return self.path_prefix is None or (path or "").startswith(self.path_prefix)
+
+    def to_dict(self) -> dict:
+        return {
+            "path_prefix": self.path_prefix,
+            "farm_id": self.farm_id,
+            "expires_in_seconds": max(0, round(self.expires_at - time.monotonic(), 1)),
+            "remaining_profiles": self.remaining,
+            "include_jobs": self.include_jobs,
+            "interval_ms": self.interval_ms,
+        }
+
+
+_CURRENT_CAPTURE: ContextVar[Optional[Capture]] = ContextVar("sampling_capture", default=None)
+
+_NO_CAPTURE = nullcontext()  # reusable, shared by every unprofiled scope
+
+
+class SamplingProfiler:
+    """
+    Opt-in sampling CPU profiler. While armed, a daemon thread reads
+    sys._current_frames() every few milliseconds and counts the stacks of
+    the threads attached to an active capture. When nothing is armed,
+    capture() is a None check and no sampler thread runs.
+    """
+
+    def __init__(self, history: int = PROFILER_HISTORY):
+        self._arm: Optional[_Arm] = None
+        self._active: list[Capture] = []
+        self._profiles: deque = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        self._window_until: dict[int, float] = {}  # capture id -> monotonic end of a time-window capture
+        self._frame_labels: dict = {}
+        self._interval_ms = PROFILER_SAMPLE_INTERVAL_MS
+
+    # --- Arming ---
+
+    def arm(self, path_prefix: Optional[str] = None, farm_id: Optional[str] = None, seconds: float = 300,
+            max_profiles: int = PROFILER_HISTORY, include_jobs: bool = True,
+            interval_ms: float = PROFILER_SAMPLE_INTERVAL_MS) -> dict:
+        """Profiles the next matching requests/jobs until `max_profiles` are captured or `seconds` pass."""
+        with self._lock:
+            self._arm = _Arm(path_prefix, farm_id, seconds, max_profiles, include_jobs, interval_ms)
+            self._interval_ms = interval_ms
+            self._ensure_sampler()
+            return self._arm.to_dict()
+
+    def start_window(self, seconds: float, interval_ms: float = PROFILER_SAMPLE_INTERVAL_MS) -> Capture:
+        """Samples every thread of the process for a fixed time window."""
+        capture = Capture(f"window {seconds:g}s", "window", all_threads=True)
+        with self._lock:
+            self._active.append(capture)
+            self._interval_ms = interval_ms
+            self._window_until[capture.id] = time.monotonic() + seconds
+            self._ensure_sampler()
+        return capture
+
+    def disarm(self):
+        with self._lock:
+            self._arm = None
+            for capture in [c for c in self._active if c.all_threads]:
+                self._finish(capture)
+
+    # --- Request / job scopes ---
+
+    def capture(self, label: str, kind: str = "request", path: Optional[str] = None, farm_id: Optional[str] = None):
+        """
+        Context manager around a request or background job. Attaches the
+        current thread to the capture already running in this context (e.g.
+        threadpool work of a profiled request), or starts a new capture if
+        the armed filter matches.
+        """
+        if self._arm is None and _CURRENT_CAPTURE.get() is None:
+            return _NO_CAPTURE
+        return self._capture_scope(label, kind, path, farm_id)
+
+    def attach(self):
+        """
+        Attaches the current thread to the capture running in this context,
+        if any, without ever starting one. Used by the threadpool worker that
+        runs a sync endpoint, see ProfiledRoute.
+        """
+        capture = _CURRENT_CAPTURE.get()
+        if capture is None:
+            return _NO_CAPTURE
+        return self._attach_scope(capture)
+
+    @contextmanager
+    def _attach_scope(self, capture: Capture):
+        thread_id = threading.get_ident()
+        with self._lock:
+            attached = not capture.finished
+            if attached:
+                capture.threads[thread_id] += 1
+        try:
+            yield capture if attached else None
+        finally:
+            if attached:
+                with self._lock:
+                    capture.threads[thread_id] -= 1
+                    if capture.threads[thread_id] <= 0:
+                        del capture.threads[thread_id]
+
+    @contextmanager
+    def _capture_scope(self, label: str, kind: str, path: Optional[str], farm_id: Optional[str]):
+        thread_id = threading.get_ident()
+        capture = _CURRENT_CAPTURE.get()
+        owner = False
+        token = None
+        with self._lock:
+            # Background jobs get their own profile even when scheduled by a profiled request
+            if capture is None or capture.finished or (kind == "job" and capture.kind != "job"):
+                capture = None
+                arm = self._arm
+                if arm is not None and arm.remaining > 0 and arm.matches(kind, path, farm_id):
+                    arm.remaining -= 1
+                    if arm.remaining == 0:
+                        self._arm = None
+                    capture = Capture(label, kind, farm_id)
+                    self._active.append(capture)
+                    owner = True
+            if capture is not None:
+                capture.threads[thread_id] += 1
+
+        if capture is None:
+            yield None
+            return
+
+        if owner:
+            token = _CURRENT_CAPTURE.set(capture)
+        try:
+            yield capture
+        finally:
+            with self._lock:
+                capture.threads[thread_id] -= 1
+                if capture.threads[thread_id] <= 0:
+                    del capture.threads[thread_id]
+                if owner:
+                    self._finish(capture)
+            if token is not None:
+                _CURRENT_CAPTURE.reset(token)
+
+    # --- Sampling ---
+
+    def _finish(self, capture: Capture):
+        """Moves an active capture to the download store. Caller holds the lock."""
+        if capture in self._active:
+            self._active.remove(capture)
+            self._window_until.pop(capture.id, None)
+            capture.finish()
+            self._profiles.append(capture)
+
+    def _ensure_sampler(self):
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._run_sampler, name="sampling-profiler", daemon=True)
+            self._sampler.start()
+
+    def _run_sampler(self):
+        sampler_id = threading.get_ident()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self._arm is not None and now >= self._arm.expires_at:
+                    self._arm = None
+                for capture in [c for c in self._active if c.all_threads and now >= self._window_until[c.id]]:
+                    self._finish(capture)
+                if self._arm is None and not self._active:
+                    self._sampler = None
+                    return
+                interval = self._interval_ms / 1000
+                targets = [(c, None if c.all_threads else list(c.threads)) for c in self._active]
+
+            if targets:
+                frames = sys._current_frames()
+                names = {t.ident: t.name for t in threading.enumerate()}
+                stacks = {}
+                for capture, thread_ids in targets:
+                    for thread_id in (frames if thread_ids is None else thread_ids):
+                        if thread_id == sampler_id or thread_id not in frames:
+                            continue
+                        if thread_id not in stacks:
+                            stacks[thread_id] = self._collapse(names.get(thread_id, str(thread_id)), frames[thread_id])
+                        capture.add_sample(stacks[thread_id])
+                del frames
+            time.sleep(interval)
+
+    def _collapse(self, thread_name: str, frame) -> str:
+        parts = []
+        while frame is not None and len(parts) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            label = self._frame_labels.get(code)
+            if label is None:
+                filename = "/".join(code.co_filename.replace("\\", "/").split("/")[-2:])
+                label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+                self._frame_labels[code] = label
+            parts.append(label)
+            frame = frame.f_back
+        parts.append(thread_name.replace(";", ":"))
+        return ";".join(reversed(parts))
+
+    # --- Inspection ---
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "armed": self._arm.to_dict() if self._arm is not None else None,
+                "active": [c.summary() for c in self._active],
+                "profiles": [c.summary() for c in reversed(self._profiles)],
+            }
+
+    def get_profile(self, profile_id: int) -> Optional[Capture]:
+        with self._lock:
+            return next((c for c in self._profiles if c.id == profile_id), None)
+
+
+sampling_profiler = SamplingProfiler()
+
+
+def _attach_worker_thread(endpoint: Callable) -> Callable:
+    @functools.wraps(endpoint)
+    def run_endpoint(*args, **kwargs):
+        with sampling_profiler.attach():
+            return endpoint(*args, **kwargs)
+
+    run_endpoint.attaches_worker_thread = True
+    return run_endpoint
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Route class whose sync endpoints attach the threadpool worker running
+    them to the request's capture, so request profiles show the handler
+    frames and not just the event loop waiting for the worker.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        # include_router() re-creates routes with the already wrapped endpoint
+        if not asyncio.iscoroutinefunction(endpoint) and not getattr(endpoint, "attaches_worker_thread", False):
+            endpoint = _attach_worker_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+@router.get("")
+def get_profiler_status():
+    """Current arming, captures in progress and stored profiles, most recent first."""
+    return sampling_profiler.status()
+
+
+@router.post("/arm")
+def arm_profiler(
+    path: Optional[str] = None,
+    farm_id: Optional[str] = None,
+    seconds: float = Query(300, gt=0, le=MAX_ARM_SECONDS),
+    max_profiles: int = Query(PROFILER_HISTORY, ge=1, le=1000),
+    jobs: bool = True,
+    interval_ms: float = Query(PROFILER_SAMPLE_INTERVAL_MS, ge=1, le=1000),
+):
+    """
+    Profiles the next requests whose path starts with `path` and/or that
+    belong to `farm_id`, plus process_mdi_predictions jobs of that farm when `jobs` is set.
+    """
+    return sampling_profiler.arm(path, farm_id, seconds, max_profiles, jobs, interval_ms)
+
+
+@router.post("/window")
+def start_profiler_window(
+    seconds: float = Query(30, gt=0, le=MAX_ARM_SECONDS),
+    interval_ms: float = Query(PROFILER_SAMPLE_INTERVAL_MS, ge=1, le=1000),
+):
+    """Samples all threads for a fixed time window."""
+    return sampling_profiler.start_window(seconds, interval_ms).summary()
+
+
+@router.post("/disarm")
+def disarm_profiler():
+    sampling_profiler.disarm()
+    return sampling_profiler.status()
+
+
+@router.get("/profiles/{profile_id}")
+def download_profile(profile_id: int):
+    """A stored profile in collapsed-stack format, e.g. `flamegraph.pl profile.folded > profile.svg`."""
+    capture = sampling_profiler.get_profile(profile_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(
+        capture.collapsed(),
+        headers={"Content-Disposition": f'attachment; filename="profile-{capture.id}.folded"'},
+    )
@@ -0,0 +1,259 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from .database import get_authenticated_supabase_client
+from .sampling_profiler import ProfiledRoute
+
+if TYPE_CHECKING:
+    # numpy/pandas are imported inside the functions to keep them out of cold start
+    import numpy as np
+    import pandas as pd
+
+router = APIRouter(prefix="/api/v1/webapp/animals", tags=["Animal Time Series"], route_class=ProfiledRoute)
+
+security = HTTPBearer()
+
+# Series served by the endpoint: response key -> column. Yield and conductivity come
+# from DELPRO_sessions_milk_yield, MDI from the voluntary row of the same session and
+# risk from the latest mdi_predictor_mastertable prediction of that session
+SERIES_COLUMNS = {
+    "yield": "TotalYield",
+    "mdi": "Mdi",
+    "conductivity": "AvgConductivity",
+    "risk": "prob_mastitis",
+}
+
+PAGE_SIZE = 1000  # PostgREST default max rows per request
+OID_CHUNK = 200  # session OIDs per in_() filter, keeps the URL short
+
+CACHE_TTL_SECONDS = 300  # 5 minutes, same as the model config cache
+CACHE_MAX_ENTRIES = 512
+
+_SERIES_CACHE: "OrderedDict[tuple, dict]" = OrderedDict()
+_SERIES_CACHE_LOCK = threading.Lock()
+
+
+def lttb_indices(x: "np.ndarray", y: "np.ndarray", threshold: int) -> "np.ndarray":
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Returns the indices of the points to keep; first and last are always kept.
+    """
+    import numpy as np
+
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    # Bucket edges for the n - 2 interior points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Average of the next bucket (or the last point for the final bucket)
+        next_start, next_end = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # Point in the current bucket forming the largest triangle with a and the average
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def downsample_series(df: "pd.DataFrame", column: str, max_points: int) -> list[dict]:
+    """Drops missing values and reduces one series to at most max_points with LTTB."""
+    if column not in df.columns:
+        return []
+    series = df[["BeginTime", column]].dropna()
+    if series.empty:
+        return []
+
+    x = series["BeginTime"].astype("int64").to_numpy() / 1e9
+    y = series[column].astype(float).to_numpy()
+    keep = lttb_indices(x, y, max_points)
+
+    times = series["BeginTime"].iloc[keep]
+    return [
+        {"t": t.isoformat(), "v": float(v)}
+        for t, v in zip(times, y[keep])
+    ]
+
+
+def _after_session(query, last: Optional[tuple[str, int]]):
+    """Keyset on (BeginTime, OID), which is unique per farm unlike BeginTime alone."""
+    if last is None:
+        return query
+    begin_time, oid = last
+    return query.or_(f'BeginTime.gt."{begin_time}",and(BeginTime.eq."{begin_time}",OID.gt.{oid})')
+
+
+def _fetch_sessions(db, animal_oid: int, start: datetime, end: datetime) -> list[dict]:
+    rows = []
+    last = None
+    while True:
+        query = db.table("DELPRO_sessions_milk_yield")\
+            .select("farm_id, OID, BeginTime, TotalYield, AvgConductivity")\
+            .eq("BasicAnimal", animal_oid)\
+            .not_.is_("OID", "null")\
+            .gte("BeginTime", start.isoformat())\
+            .lte("BeginTime", end.isoformat())
+        res = _after_session(query, last)\
+            .order("BeginTime")\
+            .order("OID")\
+            .limit(PAGE_SIZE)\
+            .execute()
+        rows.extend(res.data)
+        if len(res.data) < PAGE_SIZE:
+            return rows
+        last = (res.data[-1]["BeginTime"], res.data[-1]["OID"])
+
+
+def _fetch_session_mdi(db, sessions: list[dict]) -> dict[tuple[str, int], Optional[float]]:
+    """Mdi of the voluntary row of each session, keyed by (farm_id, OID)."""
+    oids_by_farm: dict[str, list[int]] = {}
+    for row in sessions:
+        oids_by_farm.setdefault(row["farm_id"], []).append(row["OID"])
+
+    mdi = {}
+    for farm_id, oids in oids_by_farm.items():
+        for i in range(0, len(oids), OID_CHUNK):
+            res = db.table("DELPRO_voluntary_sessions_milk_yield")\
+                .select("OID, Mdi")\
+                .eq("farm_id", farm_id)\
+                .in_("OID", oids[i:i + OID_CHUNK])\
+                .execute()
+            for row in res.data:
+                mdi[(farm_id, row["OID"])] = row.get("Mdi")
+    return mdi
+
+
+def _fetch_session_risk(db, animal_oid: int, start: datetime, end: datetime) -> dict[tuple[str, int], Optional[float]]:
+    """Latest predicted risk per session, keyed by (farm_id, session_oid); re-predictions replace older rows."""
+    risk = {}
+    last_id = None
+    while True:
+        query = db.table("mdi_predictor_mastertable")\
+            .select("id, farm_id, session_oid, prob_mastitis")\
+            .eq("animal_oid", animal_oid)\
+            .gte("BeginTime", start.isoformat())\
+            .lte("BeginTime", end.isoformat())
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        res = query.order("id").limit(PAGE_SIZE).execute()
+        for row in res.data:
+            risk[(row["farm_id"], row["session_oid"])] = row.get("prob_mastitis")
+        if len(res.data) < PAGE_SIZE:
+            return risk
+        last_id = res.data[-1]["id"]
+
+
+def _fetch_animal_rows(db, animal_oid: int, start: datetime, end: datetime) -> "pd.DataFrame":
+    """
+    One row per session of the animal in the window, from the session
+    history itself, so sessions before the predictor ran, without a
+    voluntary row or whose prediction failed are still in the series.
+    """
+    import pandas as pd
+
+    sessions = _fetch_sessions(db, animal_oid, start, end)
+    if not sessions:
+        return pd.DataFrame()
+    mdi = _fetch_session_mdi(db, sessions)
+    risk = _fetch_session_risk(db, animal_oid, start, end)
+
+    df = pd.DataFrame(sessions)
+    keys = list(zip(df["farm_id"], df["OID"]))
+    df["Mdi"] = [mdi.get(key) for key in keys]
+    df["prob_mastitis"] = [risk.get(key) for key in keys]
+    df["BeginTime"] = pd.to_datetime(df["BeginTime"], utc=True, format="ISO8601")
+    return df.sort_values("BeginTime", kind="stable")
+
+
+def _cache_get(key: tuple) -> Optional[dict]:
+    with _SERIES_CACHE_LOCK:
+        entry = _SERIES_CACHE.get(key)
+        if entry and time.time() < entry["expires_at"]:
+            _SERIES_CACHE.move_to_end(key)
+            return entry["data"]
+        return None
+
+
+def _cache_put(key: tuple, data: dict):
+    with _SERIES_CACHE_LOCK:
+        _SERIES_CACHE[key] = {"data": data, "expires_at": time.time() + CACHE_TTL_SECONDS}
+        _SERIES_CACHE.move_to_end(key)
+        while len(_SERIES_CACHE) > CACHE_MAX_ENTRIES:
+            _SERIES_CACHE.popitem(last=False)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Aware UTC datetime; naive query values are taken as UTC, like BeginTime when it is parsed."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+@router.get("/{animal_oid}/timeseries")
+def get_animal_timeseries(
+    animal_oid: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    points: int = Query(300, ge=3, le=5000),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
+    """
+    Yield, MDI, conductivity and predicted risk for one animal, each
+    downsampled server-side with LTTB to at most `points` points.
+    Defaults to the last year. RLS applies through the user's token.
+    """
+    # Both bounds are compared and cached as aware UTC, whatever offset the client sent.
+    # Default end is truncated to the minute so repeated default requests hit the cache
+    end = _as_utc(end) or datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    start = _as_utc(start) or (end - timedelta(days=365))
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    # Cache per user so RLS results are never shared between accounts
+    token_key = hashlib.sha256(credentials.credentials.encode()).hexdigest()
+    cache_key = (token_key, animal_oid, start.isoformat(), end.isoformat(), points)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        db = get_authenticated_supabase_client(credentials.credentials)
+        df = _fetch_animal_rows(db, animal_oid, start, end)
+
+        result = {
+            "animal_oid": animal_oid,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "raw_points": len(df),
+            "series": {
+                name: downsample_series(df, column, points)
+                for name, column in SERIES_COLUMNS.items()
+            } if not df.empty else {name: [] for name in SERIES_COLUMNS},
+        }
+        _cache_put(cache_key, result)
+        return result
+    except Exception as e:
+        print(f"[TimeSeries] Error building series for animal {animal_oid}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,261 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+import numpy as np
+from supabase import Client
+
+try:
+    from .probability_service import DEFAULT_MODEL_CONFIG, read_latest_model_config, invalidate_model_config_cache
+except ImportError:
+    from app.probability_service import DEFAULT_MODEL_CONFIG, read_latest_model_config, invalidate_model_config_cache
+
+# Labelled rows of mdi_predictor_mastertable: true = confirmed mastitis, false = healthy, NULL = unlabelled.
+# labelled_at is stamped by the database when the label is set (backend/sql/system_model_config_training.sql)
+LABEL_COLUMN = "mastitis_confirmed"
+LABELLED_AT_COLUMN = "labelled_at"
+
+# Labels newer than this are left for the next run, so a label whose transaction
+# commits after a run has started is never behind the watermark
+LABEL_SETTLE_SECONDS = 60
+
+CHUNK_SIZE = 1000  # PostgREST default max rows per request
+MAX_PASSES = 10
+TOLERANCE = 1e-6
+L2_PENALTY = 1e-3  # keeps the Newton step defined when a chunk stream is (nearly) separable
+
+
+def _after_watermark(query, watermark: Optional[tuple[str, int]]):
+    """Rows labelled after the (labelled_at, id) watermark."""
+    if watermark is None:
+        return query
+    labelled_at, row_id = watermark
+    return query.or_(
+        f'{LABELLED_AT_COLUMN}.gt."{labelled_at}",'
+        f'and({LABELLED_AT_COLUMN}.eq."{labelled_at}",id.gt.{row_id})'
+    )
+
+
+class LabelledChunks:
+    """
+    Re-iterable stream of (X, y) chunks of labelled mdi_predictor_mastertable
+    rows with after < (labelled_at, id) <= through, keyset-paginated on
+    (labelled_at, id), so memory stays at one chunk regardless of history
+    size and every pass sees the same rows.
+    X columns: [1, current MDI, predicted MDI] (missing values as 0, as at inference).
+    """
+
+    def __init__(self, db: Client, after: Optional[tuple[str, int]], through: tuple[str, int],
+                 chunk_size: int = CHUNK_SIZE):
+        self.db = db
+        self.after = after
+        self.through = through
+        self.chunk_size = chunk_size
+
+    def __iter__(self) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        last = self.after
+        while True:
+            # `through` is the newest row at or before its labelled_at, so lte on the timestamp is enough
+            query = self.db.table("mdi_predictor_mastertable")\
+                .select(f"id, {LABELLED_AT_COLUMN}, Mdi, mdi_2d, {LABEL_COLUMN}")\
+                .not_.is_(LABEL_COLUMN, "null")\
+                .lte(LABELLED_AT_COLUMN, self.through[0])
+            res = _after_watermark(query, last)\
+                .order(LABELLED_AT_COLUMN)\
+                .order("id")\
+                .limit(self.chunk_size)\
+                .execute()
+
+            rows = res.data
+            if not rows:
+                return
+            last = (rows[-1][LABELLED_AT_COLUMN], rows[-1]["id"])
+
+            X = np.ones((len(rows), 3))
+            X[:, 1] = [r.get("Mdi") or 0.0 for r in rows]
+            X[:, 2] = [r.get("mdi_2d") or 0.0 for r in rows]
+            y = np.array([1.0 if r[LABEL_COLUMN] else 0.0 for r in rows])
+            yield X, y
+
+            if len(rows) < self.chunk_size:
+                return
+
+
+def latest_label_watermark(db: Client, after: Optional[tuple[str, int]] = None) -> Optional[tuple[str, int]]:
+    """
+    (labelled_at, id) of the newest settled label past the watermark, or
+    None if nothing was labelled since.
+    """
+    settled_before = (datetime.now(timezone.utc) - timedelta(seconds=LABEL_SETTLE_SECONDS)).isoformat()
+    query = db.table("mdi_predictor_mastertable")\
+        .select(f"id, {LABELLED_AT_COLUMN}")\
+        .not_.is_(LABEL_COLUMN, "null")\
+        .lte(LABELLED_AT_COLUMN, settled_before)
+    res = _after_watermark(query, after)\
+        .order(LABELLED_AT_COLUMN, desc=True)\
+        .order("id", desc=True)\
+        .limit(1)\
+        .execute()
+    return (res.data[0][LABELLED_AT_COLUMN], res.data[0]["id"]) if res.data else None
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 0.5 * (1.0 + np.tanh(0.5 * z))
+
+
+def streaming_newton_pass(chunks, w: np.ndarray) -> tuple[np.ndarray, np.ndarray, float, int]:
+    """
+    One pass over the data accumulating the logistic-loss sufficient
+    statistics at w: gradient, Hessian, total log loss and row count.
+    """
+    gradient = np.zeros(3)
+    hessian = np.zeros((3, 3))
+    loss = 0.0
+    n = 0
+    for X, y in chunks:
+        p = _sigmoid(X @ w)
+        gradient += X.T @ (p - y)
+        hessian += (X * (p * (1 - p))[:, None]).T @ X
+        eps = 1e-12
+        loss -= float(np.sum(y * np.log(p + eps) + (1 - y) * np.log(1 - p + eps)))
+        n += len(y)
+    return gradient, hessian, loss, n
+
+
+def fit_logistic_streaming(chunk_source, w0: np.ndarray, prior_precision: Optional[np.ndarray] = None,
+                           max_passes: int = MAX_PASSES, tol: float = TOLERANCE) -> dict:
+    """
+    Logistic regression by Newton-Raphson, with step halving, over a
+    re-iterable chunk stream: each pass reads the data once, memory is O(chunk).
+    `chunk_source()` must return a fresh iterator of (X, y) chunks.
+
+    With `prior_precision` (the precision returned by the previous run) the
+    fit is incremental: only the new rows are streamed and the previous
+    coefficients act as a Gaussian prior (mean w0), so the result
+    approximates a fit over all rows seen so far. Without it, the
+    coefficients get an L2 penalty towards 0 and the fit starts from w0.
+    """
+    w0 = np.array(w0, dtype=float)
+    w = w0.copy()
+    history = []
+    n = 0
+    precision = None
+    previous = None  # (weights, penalised loss, step) of the last accepted point
+    passes = 0
+    for _ in range(max_passes):
+        passes += 1
+        gradient, hessian, loss, n = streaming_newton_pass(chunk_source(), w)
+        if n == 0:
+            break
+        if prior_precision is not None:
+            prior, prior_mean = prior_precision, w0
+        else:
+            # Penalise the coefficients, not the intercept
+            prior, prior_mean = L2_PENALTY * n * np.diag([0.0, 1.0, 1.0]), np.zeros(3)
+        objective = loss + 0.5 * (w - prior_mean) @ prior @ (w - prior_mean)
+
+        # Plain Newton can overshoot from a poor start (e.g. the previous coefficients on
+        # shifted data); halve the step until the penalised loss goes down again
+        if previous is not None and objective > previous[1] and np.max(np.abs(previous[2])) >= tol:
+            step = previous[2] / 2
+            w = previous[0] - step
+            previous = (previous[0], previous[1], step)
+            continue
+
+        precision = hessian + prior
+        step = np.linalg.solve(precision + 1e-9 * np.eye(3), gradient + prior @ (w - prior_mean))
+        previous = (w, objective, step)
+        w = w - step
+        history.append(loss / n)
+        if np.max(np.abs(step)) < tol:
+            break
+    return {
+        "weights": w,
+        "precision": precision,
+        "n_samples": n,
+        "passes": passes,
+        "log_loss": history[-1] if history else None,
+    }
+
+
+def train_mastitis_model(db: Client, full: bool = False, max_passes: int = MAX_PASSES) -> Optional[dict]:
+    """
+    Updates the mastitis probability coefficients with the rows labelled
+    since the last run (labelled_at past the trained_through_labelled_at /
+    trained_through_id watermark of the current config, including labels
+    set late on old rows) and writes a new versioned row to system_model_config.
+    `full` retrains over the whole labelled history instead.
+    Returns the written config, or None when there is nothing new to train on.
+
+    Fails if the current config can't be read, rather than starting over from defaults.
+    """
+    current = read_latest_model_config(db)
+    if current is None:
+        current = {**DEFAULT_MODEL_CONFIG, "version": 0}
+    w0 = np.array([
+        float(current.get("intercept", 0.0)),
+        float(current.get("coef_current_mdi", 0.0)),
+        float(current.get("coef_predicted_mdi", 0.0)),
+    ])
+
+    incremental = (
+        not full
+        and current.get("trained_through_labelled_at") is not None
+        and current.get("trained_through_id") is not None
+        and current.get("precision") is not None
+    )
+    after = (current["trained_through_labelled_at"], current["trained_through_id"]) if incremental else None
+    prior_precision = np.array(current["precision"], dtype=float) if incremental else None
+
+    through = latest_label_watermark(db, after)
+    if through is None:
+        print(f"[Training] No rows labelled in {LABEL_COLUMN} after {after}; keeping current coefficients.")
+        return None
+    print(f"[Training] {'Incremental' if incremental else 'Full'} training on labels ({after}, {through}] "
+          f"from coefficients {w0.tolist()} (version {current.get('version', 0)})")
+
+    result = fit_logistic_streaming(
+        lambda: iter(LabelledChunks(db, after, through)), w0, prior_precision, max_passes=max_passes
+    )
+    if result["n_samples"] == 0:
+        return None
+
+    intercept, coef_current, coef_predicted = (float(v) for v in result["weights"])
+    previous_samples = int(current.get("n_samples") or 0) if incremental else 0
+    config = {
+        "intercept": intercept,
+        "coef_current_mdi": coef_current,
+        "coef_predicted_mdi": coef_predicted,
+        "version": int(current.get("version") or 0) + 1,
+        "n_samples": previous_samples + result["n_samples"],
+        "training_log_loss": result["log_loss"],
+        "trained_through_labelled_at": through[0],
+        "trained_through_id": through[1],
+        "precision": result["precision"].tolist(),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    db.table("system_model_config").insert(config).execute()
+    invalidate_model_config_cache()
+
+    print(f"[Training] Wrote config version {config['version']} after {result['passes']} passes "
+          f"over {result['n_samples']} rows: {intercept:.4f}, {coef_current:.4f}, {coef_predicted:.4f}")
+    return config
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description="Update the mastitis probability coefficients with new labelled rows.")
+    parser.add_argument("--full", action="store_true", help="Retrain over the whole labelled history")
+    parser.add_argument("--max-passes", type=int, default=MAX_PASSES)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
+    if not url or not key:
+        print("Error: SUPABASE_URL or SUPABASE_KEY not found in environment.")
+        exit(1)
+
+    train_mastitis_model(create_client(url, key), args.full, args.max_passes)
@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+import importlib
+from datetime import datetime, timezone
+
+# Modules that dominate cold start. They are imported here (in the background
+# when FAST_START is on) instead of at app import time.
+HEAVY_MODULES = [
+    "numpy",
+    "pandas",
+    "joblib",
+    "sklearn",
+    "supabase",
+    ".predictor_service",
+]
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "ml_models/mdi_predictor_2d.joblib")
+
+# Retry-After sent with the 503 ingest returns while the model is still loading
+WARMUP_RETRY_AFTER_SECONDS = 15
+
+# Warm-up state reported by the readiness endpoint
+WARMUP_STATE = {
+    "fast_start": False,
+    "status": "pending",      # pending | warming | ready | failed
+    "started_at": None,
+    "finished_at": None,
+    "app_import_seconds": None,
+    "warmup_seconds": None,
+    "import_seconds": {},
+    "model": "pending",        # pending | loaded | missing | failed
+    "supabase_client": "pending",  # pending | ready | failed
+    "risk_cache": "pending",   # pending | rebuilding | ready | failed
+    "error": None,
+}
+
+_WARMUP_LOCK = threading.Lock()
+
+
+def is_fast_start_enabled() -> bool:
+    return os.environ.get("FAST_START", "").lower() in ("1", "true", "yes")
+
+
+def record_app_import_time(seconds: float):
+    WARMUP_STATE["app_import_seconds"] = round(seconds, 4)
+
+
+def _timed_import(module_name: str):
+    start = time.perf_counter()
+    importlib.import_module(module_name, package=__package__)
+    WARMUP_STATE["import_seconds"][module_name] = round(time.perf_counter() - start, 4)
+
+
+def warm_up(ml_models: dict):
+    """
+    Imports the heavy modules, creates the shared Supabase client, starts the
+    risk cache rebuild and loads the ML model into `ml_models`. Safe to call more than once.
+    """
+    with _WARMUP_LOCK:
+        if WARMUP_STATE["status"] == "ready":
+            return
+
+        WARMUP_STATE["status"] = "warming"
+        WARMUP_STATE["started_at"] = datetime.now(timezone.utc).isoformat()
+        start = time.perf_counter()
+
+        try:
+            for module_name in HEAVY_MODULES:
+                _timed_import(module_name)
+
+            # Create the shared client now so the first sync-status request doesn't pay for it
+            from .database import get_supabase_client
+            try:
+                db = get_supabase_client()
+                WARMUP_STATE["supabase_client"] = "ready"
+            except Exception:
+                WARMUP_STATE["supabase_client"] = "failed"
+                raise
+
+            # Reload the latest per-animal risk in the background so it doesn't hold up readiness;
+            # the top-K endpoint serves live predictions (rebuilt_at null) until it is done
+            WARMUP_STATE["risk_cache"] = "rebuilding"
+            threading.Thread(target=_rebuild_risk_cache, args=(db,), name="risk-cache-rebuild", daemon=True).start()
+
+            # Load the ML model
+            if os.path.exists(MODEL_PATH):
+                try:
+                    import joblib
+                    ml_models["mastitis"] = joblib.load(MODEL_PATH)
+                    WARMUP_STATE["model"] = "loaded"
+                    print(f"Model loaded from {MODEL_PATH}")
+                except Exception as e:
+                    WARMUP_STATE["model"] = "failed"
+                    print(f"[Warmup] Failed to load model from {MODEL_PATH}: {e}")
+            else:
+                WARMUP_STATE["model"] = "missing"
+                print(f"Warning: Model not found at {MODEL_PATH}")
+
+            WARMUP_STATE["status"] = "ready"
+        except Exception as e:
+            WARMUP_STATE["status"] = "failed"
+            WARMUP_STATE["error"] = str(e)
+            print(f"[Warmup] Warm-up failed: {e}")
+        finally:
+            WARMUP_STATE["finished_at"] = datetime.now(timezone.utc).isoformat()
+            WARMUP_STATE["warmup_seconds"] = round(time.perf_counter() - start, 4)
+            print(f"[Warmup] Finished with status {WARMUP_STATE['status']} in {WARMUP_STATE['warmup_seconds']}s")
+
+
+def _rebuild_risk_cache(db):
+    from .risk_cache import risk_cache
+    try:
+        risk_cache.rebuild(db)
+        WARMUP_STATE["risk_cache"] = "ready"
+    except Exception as e:
+        WARMUP_STATE["risk_cache"] = "failed"
+        print(f"[Warmup] Failed to rebuild risk cache: {e}")
+
+
+def start_background_warmup(ml_models: dict) -> threading.Thread:
+    WARMUP_STATE["fast_start"] = True
+    thread = threading.Thread(target=warm_up, args=(ml_models,), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_warming_up() -> bool:
+    """True until warm-up has finished (ready or failed)."""
+    return WARMUP_STATE["status"] in ("pending", "warming")
+
+
+def readiness_report() -> dict:
+    return {
+        "ready": WARMUP_STATE["status"] == "ready",
+        **WARMUP_STATE,
+        "import_seconds": dict(WARMUP_STATE["import_seconds"]),
+    }
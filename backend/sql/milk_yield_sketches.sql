@@ -0,0 +1,164 @@
+-- Yield sketches behind /api/v1/distribution/milk-yield (app/distribution_service.py).
+-- Sketch JSON: {"bins": {"<bin index>": frequency}, "count", "total", "min_value", "max_value"},
+-- bin index = floor(TotalYield / 0.5) (SKETCH_BIN_WIDTH).
+
+create table if not exists milk_yield_daily_sketches (
+    farm_id uuid not null,
+    day date not null,
+    parity smallint not null, -- latest LactationNumber of the animal, capped at 8; 0 = unknown
+    province text, -- farm profile at the time of the refresh, used to rebuild the rollup
+    species text,
+    sketch jsonb not null,
+    primary key (farm_id, day, parity)
+);
+
+alter table milk_yield_daily_sketches add column if not exists province text;
+alter table milk_yield_daily_sketches add column if not exists species text;
+
+create index if not exists milk_yield_daily_sketches_province_idx
+    on milk_yield_daily_sketches (province, species, day);
+
+-- Province/species rollup of the farm sketches, so a query reads O(days) rows
+create table if not exists milk_yield_province_sketches (
+    province text not null,
+    species text not null,
+    day date not null,
+    parity smallint not null,
+    sketch jsonb not null,
+    primary key (province, species, day, parity)
+);
+
+create or replace function merge_yield_sketch(a jsonb, b jsonb)
+returns jsonb
+language sql
+immutable
+as $$
+    select jsonb_build_object(
+        'bins', coalesce((
+            select jsonb_object_agg(bin, frequency)
+            from (
+                select bin, sum(frequency::bigint) as frequency
+                from (
+                    select key as bin, value as frequency from jsonb_each_text(coalesce(a -> 'bins', '{}'::jsonb))
+                    union all
+                    select key, value from jsonb_each_text(coalesce(b -> 'bins', '{}'::jsonb))
+                ) both_bins
+                group by bin
+            ) merged
+        ), '{}'::jsonb),
+        'count', coalesce((a ->> 'count')::bigint, 0) + coalesce((b ->> 'count')::bigint, 0),
+        'total', coalesce((a ->> 'total')::float8, 0) + coalesce((b ->> 'total')::float8, 0),
+        'min_value', least((a ->> 'min_value')::float8, (b ->> 'min_value')::float8),
+        'max_value', greatest((a ->> 'max_value')::float8, (b ->> 'max_value')::float8)
+    );
+$$;
+
+create or replace aggregate merge_yield_sketches(jsonb) (
+    sfunc = merge_yield_sketch,
+    stype = jsonb,
+    initcond = '{}'
+);
+
+drop function if exists merge_milk_yield_sketches(uuid, text, text, jsonb);
+
+-- Recomputes a farm's sketches for the given days from DELPRO_sessions_milk_yield, then
+-- rebuilds the province rollup of those days from the farm rows. Every sketch is derived from
+-- the stored sessions, so re-sent or changed sessions replace their earlier value instead of
+-- being counted again, whichever instance wrote them.
+create or replace function refresh_milk_yield_sketches(p_farm_id uuid, p_days date[])
+returns void
+language plpgsql
+security definer
+as $$
+declare
+    v_province text;
+    v_species text;
+begin
+    select province, coalesce(animal_species, 'C4') into v_province, v_species
+    from profiles
+    where farm_id = p_farm_id
+    limit 1;
+
+    -- Concurrent refreshes of the same farm, or of the same province, run one after the other
+    perform pg_advisory_xact_lock(hashtext('milk_yield_sketches:farm:' || p_farm_id::text));
+
+    delete from milk_yield_daily_sketches
+    where farm_id = p_farm_id and day = any(p_days);
+
+    insert into milk_yield_daily_sketches (farm_id, day, parity, province, species, sketch)
+    with parities as (
+        select "Animal" as animal, max("LactationNumber") as lactation_number
+        from "DELPRO_animals_lactations_summary"
+        where farm_id = p_farm_id
+        group by "Animal"
+    ),
+    yields as (
+        select
+            s."BeginTime"::date as day,
+            case when p.lactation_number >= 1 then least(p.lactation_number, 8) else 0 end::smallint as parity,
+            s."TotalYield"::float8 as value
+        from "DELPRO_sessions_milk_yield" s
+        left join parities p on p.animal = s."BasicAnimal"
+        where s.farm_id = p_farm_id
+          and s."BeginTime"::date = any(p_days)
+          and s."TotalYield" is not null
+          and s."TotalYield"::float8 not in ('NaN'::float8, 'Infinity'::float8, '-Infinity'::float8)
+    ),
+    bins as (
+        select day, parity, floor(value / 0.5)::bigint as bin, count(*) as frequency
+        from yields
+        group by day, parity, floor(value / 0.5)::bigint
+    )
+    select
+        p_farm_id, y.day, y.parity, v_province, v_species,
+        jsonb_build_object(
+            'bins', (select jsonb_object_agg(b.bin::text, b.frequency) from bins b where b.day = y.day and b.parity = y.parity),
+            'count', count(*),
+            'total', sum(y.value),
+            'min_value', min(y.value),
+            'max_value', max(y.value)
+        )
+    from yields y
+    group by y.day, y.parity;
+
+    if v_province is not null then
+        perform pg_advisory_xact_lock(hashtext('milk_yield_sketches:province:' || v_province || ':' || v_species));
+
+        delete from milk_yield_province_sketches
+        where province = v_province and species = v_species and day = any(p_days);
+
+        insert into milk_yield_province_sketches (province, species, day, parity, sketch)
+        select v_province, v_species, day, parity, merge_yield_sketches(sketch)
+        from milk_yield_daily_sketches
+        where province = v_province and species = v_species and day = any(p_days)
+        group by day, parity;
+    end if;
+end;
+$$;
+
+-- Backfill over existing history: refreshes every day of [p_from, p_to] that has sessions.
+-- Run per farm and date window (python -m app.distribution_service --backfill) so each call stays short.
+create or replace function backfill_milk_yield_sketches(p_farm_id uuid, p_from date, p_to date)
+returns integer
+language plpgsql
+security definer
+as $$
+declare
+    v_days date[];
+begin
+    select array_agg(distinct "BeginTime"::date) into v_days
+    from "DELPRO_sessions_milk_yield"
+    where farm_id = p_farm_id
+      and "BeginTime" >= p_from
+      and "BeginTime" < p_to + 1;
+
+    if v_days is null then
+        return 0;
+    end if;
+    perform refresh_milk_yield_sketches(p_farm_id, v_days);
+    return cardinality(v_days);
+end;
+$$;
+
+revoke execute on function refresh_milk_yield_sketches(uuid, date[]) from public, anon, authenticated;
+revoke execute on function backfill_milk_yield_sketches(uuid, date, date) from public, anon, authenticated;
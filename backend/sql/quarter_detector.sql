@@ -0,0 +1,25 @@
+-- Tables written by app/quarter_detector.py after each ingest.
+
+create table if not exists mdi_quarter_deviations (
+    id bigserial primary key,
+    farm_id uuid not null,
+    session_oid bigint not null,
+    animal_oid bigint not null,
+    "BeginTime" timestamp,
+    quarter text not null,  -- LF | RF | LR | RR
+    signal text not null,   -- Conductivity | Blood | PeakFlow
+    value double precision,
+    baseline double precision,
+    z_score double precision,
+    cusum double precision
+);
+create index if not exists mdi_quarter_deviations_farm_session on mdi_quarter_deviations (farm_id, session_oid);
+
+-- Per-animal detector state: {"<signal>:<quarter>": [mean, var, n, cusum, consecutive flags]}
+create table if not exists mdi_quarter_detector_state (
+    farm_id uuid not null,
+    animal_oid bigint not null,
+    state jsonb not null,
+    last_session_oid bigint,
+    primary key (farm_id, animal_oid)
+);
@@ -0,0 +1,17 @@
+-- Latest prediction per animal of one farm, read by RiskCache.rebuild (app/risk_cache.py).
+-- Keyset-paginated on animal_oid, so each page returns at most p_limit rows.
+create or replace function get_latest_risk_per_animal(p_farm_id uuid, p_since timestamptz, p_after_animal bigint default null, p_limit integer default 1000)
+returns setof mdi_predictor_mastertable
+language sql
+stable
+as $$
+    select distinct on (m.animal_oid) m.*
+    from mdi_predictor_mastertable m
+    where m.farm_id = p_farm_id
+      and m."BeginTime" >= p_since
+      and (p_after_animal is null or m.animal_oid > p_after_animal)
+    order by m.animal_oid, m."BeginTime" desc, m.id desc
+    limit p_limit;
+$$;
+
+revoke execute on function get_latest_risk_per_animal(uuid, timestamptz, bigint, integer) from public, anon, authenticated;
@@ -0,0 +1,46 @@
+-- Schema used by app/training_service.py.
+
+-- Training label of a prediction row: true = confirmed mastitis, false = healthy, null = unlabelled.
+-- Labels are usually set days after the row was inserted.
+alter table mdi_predictor_mastertable add column if not exists mastitis_confirmed boolean;
+-- When the label was last set or changed; the trainer's watermark, so late labels on old rows are trained on
+alter table mdi_predictor_mastertable add column if not exists labelled_at timestamptz;
+
+create or replace function stamp_mastitis_labelled_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    if new.mastitis_confirmed is null then
+        new.labelled_at := null;
+    elsif tg_op = 'INSERT' or new.mastitis_confirmed is distinct from old.mastitis_confirmed then
+        new.labelled_at := clock_timestamp();
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists mdi_predictor_mastertable_labelled_at on mdi_predictor_mastertable;
+create trigger mdi_predictor_mastertable_labelled_at
+    before insert or update of mastitis_confirmed on mdi_predictor_mastertable
+    for each row execute function stamp_mastitis_labelled_at();
+
+-- Rows labelled before the trigger existed
+update mdi_predictor_mastertable
+set labelled_at = now()
+where mastitis_confirmed is not null and labelled_at is null;
+
+create index if not exists mdi_predictor_mastertable_labelled_idx
+    on mdi_predictor_mastertable (labelled_at, id)
+    where mastitis_confirmed is not null;
+
+-- Columns written on every (re)training run
+alter table system_model_config add column if not exists version integer;
+alter table system_model_config add column if not exists n_samples bigint;
+alter table system_model_config add column if not exists training_log_loss double precision;
+-- Label watermark (labelled_at, id) of the last row the coefficients have seen; the next run
+-- trains on rows labelled after it
+alter table system_model_config add column if not exists trained_through_labelled_at timestamptz;
+alter table system_model_config add column if not exists trained_through_id bigint;
+-- 3x3 posterior precision of [intercept, coef_current_mdi, coef_predicted_mdi], the prior of the next run
+alter table system_model_config add column if not exists precision jsonb;
@@ -51,6 +51,8 @@ public class SyncWorker : BackgroundService
 
     // CONFIGURATION
     private const int PollingIntervalSeconds = 1800; // 30 minutes
+    private const int DefaultBatchSize = 2000; // Rows per table per upload, unless the backend asks for fewer
+    private const int ErrorRetrySeconds = 60;
     
     public SyncWorker(HttpClient httpClient, ILogger<SyncWorker> logger, IConfiguration configuration)
     {
@@ -140,21 +142,24 @@ public class SyncWorker : BackgroundService
                 
                 _logger.LogInformation("Cloud Watermarks - Sess: {S}, Anim: {A}, Lact: {L}, Div: {D}", lastOid, lastAnimalOid, lastLactationOid, lastDiversionOid);
 
-                // 2. Fetch Data based on individual watermarks
-                _logger.LogInformation("Sync Cycle: Fetching data... (Sess>{S}, Anim>{A}, Lact>{L}, Div>{D})", lastOid, lastAnimalOid, lastLactationOid, lastDiversionOid);
-                var payload = FetchBatchData(farmId, lastOid, lastAnimalOid, lastLactationOid, lastDiversionOid, dbName);
+                // 2. Fetch Data based on individual watermarks, in batches no larger than the backend asks for
+                int batchSize = Math.Clamp(status.recommended_batch_size, 1, DefaultBatchSize);
+                _logger.LogInformation("Sync Cycle: Fetching data... (Sess>{S}, Anim>{A}, Lact>{L}, Div>{D}, Batch {B})", lastOid, lastAnimalOid, lastLactationOid, lastDiversionOid, batchSize);
+                var payload = FetchBatchData(farmId, lastOid, lastAnimalOid, lastLactationOid, lastDiversionOid, dbName, batchSize);
 
                 // 3. Upload
-                await UploadData(payload, stoppingToken);
+                var retryAfter = await UploadData(payload, stoppingToken);
 
-                // Wait before next cycle
-                _logger.LogInformation("Waiting {Sec} seconds before next sync...", currentInterval);
-                await Task.Delay(TimeSpan.FromSeconds(currentInterval), stoppingToken);
+                // Wait before next cycle: never faster than the backend recommends; when the upload was
+                // refused (429 overloaded / 503 warming up) retry after the delay it sent instead
+                var wait = retryAfter ?? TimeSpan.FromSeconds(Math.Max(currentInterval, status.recommended_poll_interval_seconds));
+                _logger.LogInformation("Waiting {Sec} seconds before next sync...", (int)wait.TotalSeconds);
+                await Task.Delay(wait, stoppingToken);
             }
             catch (Exception ex)
             {
                 _logger.LogError(ex, "Error in Sync Cycle");
-                await Task.Delay(TimeSpan.FromSeconds(60), stoppingToken); // Retry sooner on error
+                await Task.Delay(TimeSpan.FromSeconds(ErrorRetrySeconds), stoppingToken); // Retry sooner on error
             }
         }
     }
@@ -240,12 +245,13 @@ public class SyncWorker : BackgroundService
 
     // RunSyncCycle method removed as logic is now in ExecuteAsync
 
-    private async Task UploadData(IngestPayload payload, CancellationToken stoppingToken)
+    // Returns the Retry-After delay when the backend refused the batch (429/503), else null
+    private async Task<TimeSpan?> UploadData(IngestPayload payload, CancellationToken stoppingToken)
     {
         if (payload.basic_animals.Count == 0 && payload.sessions_milk_yield.Count == 0 && payload.lactations_summary.Count == 0 && payload.history_milk_diversion_info.Count == 0)
         {
             _logger.LogInformation("No new data to upload.");
-            return;
+            return null;
         }
 
         _logger.LogInformation("Uploading batch: {Anim} Animals, {Lact} Lactations, {Sess} Sessions, {Div} Diversions...", 
@@ -260,6 +266,12 @@ public class SyncWorker : BackgroundService
             {
                 _logger.LogInformation("Upload SUCCESS.");
             }
+            else if (response.StatusCode == System.Net.HttpStatusCode.TooManyRequests || response.StatusCode == System.Net.HttpStatusCode.ServiceUnavailable)
+            {
+                var retryAfter = response.Headers.RetryAfter?.Delta ?? TimeSpan.FromSeconds(ErrorRetrySeconds);
+                _logger.LogWarning("Upload deferred by backend: {StatusCode}, retrying in {Sec} seconds", response.StatusCode, (int)retryAfter.TotalSeconds);
+                return retryAfter;
+            }
             else
             {
                 var error = await response.Content.ReadAsStringAsync(stoppingToken);
@@ -270,6 +282,7 @@ public class SyncWorker : BackgroundService
         {
             _logger.LogError(ex, "Error during upload.");
         }
+        return null;
     }
 
     // --- DATA FETCHING ---
@@ -297,7 +310,7 @@ public class SyncWorker : BackgroundService
         return $"Server=localhost;Database={databaseName};User Id=sa;Password=PecusChain2025!;TrustServerCertificate=True;";
     }
 
-    private IngestPayload FetchBatchData(string farmId, long lastSessionOid, long lastAnimalOid, long lastLactationOid, long lastHistoryMilkDiversionOid, string databaseName)
+    private IngestPayload FetchBatchData(string farmId, long lastSessionOid, long lastAnimalOid, long lastLactationOid, long lastHistoryMilkDiversionOid, string databaseName, int batchSize)
     {
         var connStr = GetConnectionString(databaseName);
         if (IsMockMode(connStr)) return FetchMockIncrementalBatch(farmId, lastSessionOid); // Reuse mock logic
@@ -321,7 +334,7 @@ public class SyncWorker : BackgroundService
                 var oneYearAgo = DateTime.Now.AddYears(-1);
                 
                 var sqlAnimals = $@"
-                    SELECT TOP 2000 * FROM [{databaseName}].[dbo].[BasicAnimal] 
+                    SELECT TOP (@BatchSize) * FROM [{databaseName}].[dbo].[BasicAnimal] 
                     WHERE (ExitDate IS NULL OR ExitDate > @OneYearAgo) 
                     AND OID > @LastAnimalOID 
                     ORDER BY OID ASC";
@@ -329,6 +342,7 @@ public class SyncWorker : BackgroundService
                 using (var cmd = new SqlCommand(sqlAnimals, conn))
                 {
                     cmd.Parameters.AddWithValue("@LastAnimalOID", lastAnimalOid);
+                    cmd.Parameters.AddWithValue("@BatchSize", batchSize);
                     cmd.Parameters.AddWithValue("@OneYearAgo", oneYearAgo);
                     using var r = cmd.ExecuteReader();
                     while (r.Read()) { animals.Add(MapAnimal(r)); }
@@ -369,7 +383,7 @@ public class SyncWorker : BackgroundService
             {
                 var oneYearAgo = DateTime.Now.AddYears(-1);
                 var sqlLact = $@"
-                    SELECT TOP 2000 L.* 
+                    SELECT TOP (@BatchSize) L.* 
                     FROM [{databaseName}].[dbo].[AnimalLactationSummary] L
                     JOIN [{databaseName}].[dbo].[BasicAnimal] A ON L.Animal = A.OID
                     WHERE (A.ExitDate IS NULL OR A.ExitDate > @OneYearAgo)
@@ -379,6 +393,7 @@ public class SyncWorker : BackgroundService
                 using (var cmd = new SqlCommand(sqlLact, conn))
                 {
                     cmd.Parameters.AddWithValue("@LastLactationOID", lastLactationOid);
+                    cmd.Parameters.AddWithValue("@BatchSize", batchSize);
                     cmd.Parameters.AddWithValue("@OneYearAgo", oneYearAgo);
                     using var r = cmd.ExecuteReader();
                     while (r.Read()) { lactations.Add(MapLactation(r)); }
@@ -413,13 +428,13 @@ public class SyncWorker : BackgroundService
                     _logger.LogInformation("Session Sync Strategy: First Run. Starting from {Date} (HasRecentData: {Has})", startDate, hasRecentData);
 
                     sqlSessions = $@"
-                        SELECT TOP 2000 * FROM [{databaseName}].[dbo].[SessionMilkYield] 
+                        SELECT TOP (@BatchSize) * FROM [{databaseName}].[dbo].[SessionMilkYield] 
                         WHERE BeginTime > @StartDate 
                         ORDER BY OID ASC";
                 }
                 else
                 {
-                    sqlSessions = $"SELECT TOP 2000 * FROM [{databaseName}].[dbo].[SessionMilkYield] WHERE OID > @LastSessionOID ORDER BY OID ASC";
+                    sqlSessions = $"SELECT TOP (@BatchSize) * FROM [{databaseName}].[dbo].[SessionMilkYield] WHERE OID > @LastSessionOID ORDER BY OID ASC";
                 }
 
                 using (var cmd = new SqlCommand(sqlSessions, conn))
@@ -429,6 +444,8 @@ public class SyncWorker : BackgroundService
                     else
                         cmd.Parameters.AddWithValue("@StartDate", startDate);
 
+                    cmd.Parameters.AddWithValue("@BatchSize", batchSize);
+
                     using var r = cmd.ExecuteReader();
                     while (r.Read()) { sessions.Add(MapSession(r)); }
                 }
@@ -470,13 +487,14 @@ public class SyncWorker : BackgroundService
             try 
             {
                 var sqlDiversion = $@"
-                    SELECT TOP 2000 * FROM [{databaseName}].[dbo].[HistoryMilkDiversionInfo]
+                    SELECT TOP (@BatchSize) * FROM [{databaseName}].[dbo].[HistoryMilkDiversionInfo]
                     WHERE OID > @LastDiversionOID
                     ORDER BY OID ASC";
 
                 using (var cmd = new SqlCommand(sqlDiversion, conn))
                 {
                     cmd.Parameters.AddWithValue("@LastDiversionOID", lastHistoryMilkDiversionOid);
+                    cmd.Parameters.AddWithValue("@BatchSize", batchSize);
                     using var r = cmd.ExecuteReader();
                     while (r.Read()) { diversions.Add(MapHistoryMilkDiversionInfo(r)); }
                 }
@@ -933,6 +951,6 @@ public record IngestPayload(
     List<DelproHistoryAnimal> history_animals
 );
 
-public record SyncStatusResponse(long last_oid, long last_animal_oid, long last_lactation_oid, long last_history_milk_diversion_oid);
+public record SyncStatusResponse(long last_oid, long last_animal_oid, long last_lactation_oid, long last_history_milk_diversion_oid, int recommended_batch_size = 2000, int recommended_poll_interval_seconds = 60);
 
 public record FarmRegistrationResponse(string farm_id, string name, DateTime created_at);